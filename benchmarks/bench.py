@@ -0,0 +1,625 @@
+"""
+Benchmarks for jaraco.collections.
+
+Each case times an operation on one of the collections across a
+sweep of sizes, reporting the time per operation beside that of
+the equivalent operation on a plain dict. With the package installed
+(``pip install -e .``), run from the project root::
+
+    python benchmarks/bench.py --max-size 100000 --output results.json
+
+A later run may be compared with stored results, failing (with a
+non-zero exit status) if any case is slower than in the baseline by
+more than the tolerance::
+
+    python benchmarks/bench.py --baseline results.json --tolerance 0.25
+
+Everything runs in-process, with no services or network required.
+"""
+
+from __future__ import annotations
+
+import argparse
+import collections.abc
+import concurrent.futures
+import functools
+import json
+import platform
+import random
+import sys
+import timeit
+from typing import Callable, NamedTuple
+
+from jaraco.collections import (
+    BidirectionalMap,
+    BijectiveMap,
+    CaseInsensitiveDict,
+    CaseInsensitiveMultiDict,
+    ConcurrentFoldedCaseKeyedDict,
+    ConcurrentFreezableDefaultDict,
+    DenseEnumeration,
+    DictStack,
+    Enumeration,
+    FoldedCaseKeyedDict,
+    FreezableDefaultDict,
+    FrozenDict,
+    KeyTransformingDict,
+    Mask,
+    PersistentDictStack,
+    Projection,
+    RangeMap,
+    WeightedLookup,
+)
+
+# the number of operations in each timed batch of lookups
+batch = 1000
+
+sizes = [10**exponent for exponent in range(1, 7)]
+
+
+class Case(NamedTuple):
+    setup: Callable[[int], tuple[Callable[[], object], int]]
+    baseline: str | None
+
+
+cases: dict[str, Case] = {}
+
+
+def case(name: str, baseline: str | None = None):
+    """
+    Register a case, given a function that takes a size and returns
+    a function to time and the number of operations it performs.
+    If the function to time has a ``close`` method, it's called
+    once the timing is done.
+    """
+
+    def register(setup):
+        cases[name] = Case(setup, baseline)
+        return setup
+
+    return register
+
+
+def make_keys(size: int) -> list[str]:
+    return [f'Key-{number}' for number in range(size)]
+
+
+def sample(population: collections.abc.Sequence, size: int = batch) -> list:
+    rand = random.Random(len(population))
+    return [rand.choice(population) for _ in range(size)]
+
+
+def exhaust(iterable) -> None:
+    for _ in iterable:
+        pass
+
+
+def lookups(mapping, keys):
+    return lambda: exhaust(map(mapping.__getitem__, keys)), len(keys)
+
+
+def attributes(target, names):
+    lookup = functools.partial(getattr, target)
+    return lambda: exhaust(map(lookup, names)), len(names)
+
+
+@case('dict.getitem')
+def dict_getitem(size):
+    keys = make_keys(size)
+    return lookups(dict.fromkeys(keys, 'value'), sample(keys))
+
+
+@case('dict.build')
+def dict_build(size):
+    items = [(key, 'value') for key in make_keys(size)]
+    return lambda: dict(items), size
+
+
+@case('dict.iter')
+def dict_iter(size):
+    data = dict.fromkeys(make_keys(size))
+    return lambda: exhaust(data), size
+
+
+@case('dict.len')
+def dict_len(size):
+    data = dict.fromkeys(make_keys(size))
+    return lambda: [len(data) for _ in range(batch)], batch
+
+
+@case('dict.project')
+def dict_project(size):
+    space = dict.fromkeys(make_keys(size), 'value')
+    keys = sample(list(space), 5)
+    return lambda: {key: space[key] for key in keys if key in space}, 1
+
+
+@case('dict.project.records')
+def dict_project_records(size):
+    records = [dict.fromkeys(make_keys(10), 'value') for _ in range(size)]
+    keys = ['Key-1', 'Key-3', 'Key-5']
+    return lambda: [{key: record[key] for key in keys} for record in records], size
+
+
+@case('RangeMap.getitem', baseline='dict.getitem')
+def range_map_getitem(size):
+    range_map = RangeMap({bound: bound % 7 for bound in range(size)})
+    return lookups(range_map, [item + 0.5 for item in sample(range(size - 1))])
+
+
+@case('RangeMap.build', baseline='dict.build')
+def range_map_build(size):
+    items = [(bound, bound % 7) for bound in range(size)]
+    return lambda: RangeMap(items), size
+
+
+@case('DictStack.getitem', baseline='dict.getitem')
+def dict_stack_getitem(size):
+    keys = make_keys(size)
+    scopes = [dict.fromkeys(keys[depth::10], depth) for depth in range(10)]
+    return lookups(DictStack(scopes), sample(keys))
+
+
+@case('DictStack.iter', baseline='dict.iter')
+def dict_stack_iter(size):
+    keys = make_keys(size)
+    stack = DictStack([dict.fromkeys(keys[depth::10]) for depth in range(10)])
+    return lambda: exhaust(stack), size
+
+
+@case('DictStack.len', baseline='dict.len')
+def dict_stack_len(size):
+    keys = make_keys(size)
+    stack = DictStack([dict.fromkeys(keys[depth::10]) for depth in range(10)])
+    return lambda: [len(stack) for _ in range(10)], 10
+
+
+@case('KeyTransformingDict.getitem', baseline='dict.getitem')
+def key_transforming_dict_getitem(size):
+    keys = make_keys(size)
+    return lookups(KeyTransformingDict(dict.fromkeys(keys)), sample(keys))
+
+
+@case('DictStack.fork')
+def dict_stack_fork(size):
+    keys = make_keys(size)
+    stack = DictStack([dict.fromkeys(keys[depth::10]) for depth in range(10)])
+
+    def fork():
+        *scopes, top = list.__iter__(stack)
+        forked = DictStack([*scopes, dict(top)])
+        forked['request'] = 'value'
+        return forked['Key-0']
+
+    return fork, 1
+
+
+@case('PersistentDictStack.fork', baseline='DictStack.fork')
+def persistent_dict_stack_fork(size):
+    keys = make_keys(size)
+    stack = PersistentDictStack(dict.fromkeys(keys[depth::10]) for depth in range(10))
+    stack.push({})
+
+    def fork():
+        forked = stack.fork()
+        forked['request'] = 'value'
+        return forked['Key-0']
+
+    return fork, 1
+
+
+@case('PersistentDictStack.getitem', baseline='DictStack.getitem')
+def persistent_dict_stack_getitem(size):
+    keys = make_keys(size)
+    scopes = [dict.fromkeys(keys[depth::10], depth) for depth in range(10)]
+    return lookups(PersistentDictStack(scopes), sample(keys))
+
+
+@case('KeyTransformingDict.setitem', baseline='dict.build')
+def key_transforming_dict_setitem(size):
+    items = [(key, 'value') for key in make_keys(size)]
+
+    def build():
+        mapping = KeyTransformingDict()
+        for key, value in items:
+            mapping[key] = value
+
+    return build, size
+
+
+@case('KeyTransformingDict.build', baseline='KeyTransformingDict.setitem')
+def key_transforming_dict_build(size):
+    items = [(key, 'value') for key in make_keys(size)]
+    return lambda: KeyTransformingDict(items), size
+
+
+@case('KeyTransformingDict.update', baseline='KeyTransformingDict.setitem')
+def key_transforming_dict_update(size):
+    items = [(key, 'value') for key in make_keys(size)]
+    return lambda: KeyTransformingDict().update(items), size
+
+
+@case('KeyTransformingDict.copy', baseline='KeyTransformingDict.setitem')
+def key_transforming_dict_copy(size):
+    mapping = KeyTransformingDict(dict.fromkeys(make_keys(size)))
+    return mapping.copy, size
+
+
+@case('FoldedCaseKeyedDict.getitem', baseline='dict.getitem')
+def folded_case_keyed_dict_getitem(size):
+    keys = make_keys(size)
+    mapping = FoldedCaseKeyedDict(dict.fromkeys(keys))
+    return lookups(mapping, [key.upper() for key in sample(keys)])
+
+
+@case('FoldedCaseKeyedDict.build', baseline='dict.build')
+def folded_case_keyed_dict_build(size):
+    items = [(key, 'value') for key in make_keys(size)]
+    return lambda: FoldedCaseKeyedDict(items), size
+
+
+@case('BidirectionalMap.getitem', baseline='BijectiveMap.getitem')
+def bidirectional_map_getitem(size):
+    keys = make_keys(size)
+    mapping = BidirectionalMap((key, number) for number, key in enumerate(keys))
+    return lookups(mapping, sample(keys))
+
+
+@case('BidirectionalMap.build', baseline='BijectiveMap.build')
+def bidirectional_map_build(size):
+    items = [(key, number) for number, key in enumerate(make_keys(size))]
+    return lambda: BidirectionalMap(items), size
+
+
+@case('CaseInsensitiveDict.getitem', baseline='dict.getitem')
+def case_insensitive_dict_getitem(size):
+    keys = make_keys(size)
+    mapping = CaseInsensitiveDict(dict.fromkeys(keys))
+    return lookups(mapping, [key.upper() for key in sample(keys)])
+
+
+@case('CaseInsensitiveDict.build', baseline='dict.build')
+def case_insensitive_dict_build(size):
+    items = [(key, 'value') for key in make_keys(size)]
+    return lambda: CaseInsensitiveDict(items), size
+
+
+@case('CaseInsensitiveMultiDict.getitem', baseline='CaseInsensitiveDict.getitem')
+def case_insensitive_multi_dict_getitem(size):
+    keys = make_keys(size)
+    mapping = CaseInsensitiveMultiDict((key, 'value') for key in keys * 2)
+    return lookups(mapping, [key.upper() for key in sample(keys)])
+
+
+@case('BijectiveMap.getitem', baseline='dict.getitem')
+def bijective_map_getitem(size):
+    keys = make_keys(size)
+    mapping = BijectiveMap((key, number) for number, key in enumerate(keys))
+    return lookups(mapping, sample(keys))
+
+
+@case('BijectiveMap.build', baseline='dict.build')
+def bijective_map_build(size):
+    items = [(key, number) for number, key in enumerate(make_keys(size))]
+    return lambda: BijectiveMap(items), size
+
+
+@case('Enumeration.decode')
+def enumeration_decode(size):
+    codes = range(size)
+    return lookups(Enumeration(make_keys(size)), sample(codes))
+
+
+@case('DenseEnumeration.decode', baseline='Enumeration.decode')
+def dense_enumeration_decode(size):
+    codes = range(size)
+    return lookups(DenseEnumeration(make_keys(size)), sample(codes))
+
+
+@case('DenseEnumeration.decode_many', baseline='Enumeration.decode')
+def dense_enumeration_decode_many(size):
+    enumeration = DenseEnumeration(make_keys(size))
+    codes = sample(range(size))
+    return lambda: enumeration.decode_many(codes), len(codes)
+
+
+@case('Enumeration.attribute')
+def enumeration_attribute(size):
+    keys = make_keys(size)
+    return attributes(Enumeration(keys), sample(keys))
+
+
+@case('DenseEnumeration.attribute', baseline='Enumeration.attribute')
+def dense_enumeration_attribute(size):
+    keys = make_keys(size)
+    return attributes(DenseEnumeration(keys), sample(keys))
+
+
+@case('Enumeration.names')
+def enumeration_names(size):
+    enumeration = Enumeration(make_keys(size))
+    return lambda: exhaust(enumeration.names), size
+
+
+@case('DenseEnumeration.names', baseline='Enumeration.names')
+def dense_enumeration_names(size):
+    enumeration = DenseEnumeration(make_keys(size))
+    return lambda: exhaust(enumeration.names), size
+
+
+@case('FrozenDict.getitem', baseline='dict.getitem')
+def frozen_dict_getitem(size):
+    keys = make_keys(size)
+    return lookups(FrozenDict(dict.fromkeys(keys)), sample(keys))
+
+
+@case('FrozenDict.build', baseline='dict.build')
+def frozen_dict_build(size):
+    items = [(key, 'value') for key in make_keys(size)]
+    return lambda: FrozenDict(items), size
+
+
+@case('FrozenDict.hash')
+def frozen_dict_hash(size):
+    frozen = FrozenDict(dict.fromkeys(make_keys(size), 'value'))
+    return lambda: hash(frozen), 1
+
+
+@case('FrozenDict.rebuild')
+def frozen_dict_rebuild(size):
+    keys = make_keys(size)
+    frozen = FrozenDict(dict.fromkeys(keys, 'value'))
+    changes = sample(keys, 100)
+
+    def rebuild():
+        for key in changes:
+            FrozenDict({**frozen, key: 'changed'})
+
+    return rebuild, len(changes)
+
+
+@case('FrozenDict.set', baseline='FrozenDict.rebuild')
+def frozen_dict_set(size):
+    keys = make_keys(size)
+    frozen = FrozenDict(dict.fromkeys(keys, 'value')).set(keys[0], 'value')
+    changes = sample(keys, 100)
+    return lambda: exhaust(frozen.set(key, 'changed') for key in changes), len(changes)
+
+
+@case('FrozenDict.getitem.derived', baseline='FrozenDict.getitem')
+def frozen_dict_getitem_derived(size):
+    keys = make_keys(size)
+    frozen = FrozenDict(dict.fromkeys(keys)).set(keys[0], 'value')
+    return lookups(frozen, sample(keys))
+
+
+@case('FrozenDict.cache-probe', baseline='dict.getitem')
+def frozen_dict_cache_probe(size):
+    configs = [FrozenDict(key=key, flag=None) for key in make_keys(size)]
+    cache = dict.fromkeys(configs, 'value')
+    # equal but distinct keys, as when each caller builds its own
+    probes = [FrozenDict(config) for config in sample(configs)]
+    return lookups(cache, probes)
+
+
+@case('Projection.len', baseline='dict.project')
+def projection_len(size):
+    space = dict.fromkeys(make_keys(size), 'value')
+    keys = sample(list(space), 5)
+    return lambda: len(Projection(keys, space)), 1
+
+
+@case('Projection.dict', baseline='dict.project')
+def projection_dict(size):
+    space = dict.fromkeys(make_keys(size), 'value')
+    keys = sample(list(space), 5)
+    return lambda: dict(Projection(keys, space)), 1
+
+
+@case('Projection.records', baseline='dict.project.records')
+def projection_records(size):
+    records = [dict.fromkeys(make_keys(10), 'value') for _ in range(size)]
+    keys = ['Key-1', 'Key-3', 'Key-5']
+    return lambda: [dict(Projection(keys, record)) for record in records], size
+
+
+@case('Projection.apply_many', baseline='Projection.records')
+def projection_apply_many(size):
+    records = [dict.fromkeys(make_keys(10), 'value') for _ in range(size)]
+    keys = ['Key-1', 'Key-3', 'Key-5']
+    return lambda: exhaust(Projection.apply_many(keys, records)), size
+
+
+@case('Mask.nested', baseline='Mask.len')
+def mask_nested(size):
+    space = dict.fromkeys(make_keys(size), 'value')
+    view = space
+    for keys in (sample(list(space), 5) for _ in range(5)):
+        view = Mask(keys, view)
+    return lambda: len(view), 1
+
+
+@case('Mask.len', baseline='dict.project')
+def mask_len(size):
+    space = dict.fromkeys(make_keys(size), 'value')
+    keys = sample(list(space), 5)
+    return lambda: len(Mask(keys, space)), 1
+
+
+@case('random.choices')
+def random_choices(size):
+    weights = sample(range(1, 100), size)
+    population = range(size)
+    rand = random.Random(0)
+    return lambda: rand.choices(population, weights, k=batch), batch
+
+
+@case('WeightedLookup.random', baseline='random.choices')
+def weighted_lookup_random(size):
+    lookup = WeightedLookup(zip(range(size), sample(range(1, 100), size)))
+    rand = random.Random(0)
+    return lambda: [lookup.random(rand) for _ in range(batch)], batch
+
+
+def set_and_get(mapping, keys):
+    for key in keys:
+        mapping[key] = key
+        mapping[key]
+
+
+def pop_and_default(mapping, keys):
+    for key in keys:
+        mapping.pop(key, None)
+        mapping[key]
+
+
+def threaded(name, factory, operate, thread_counts, baseline=None):
+    """
+    Register cases sharing one mapping among threads, each performing
+    the operation on its part of a batch of keys.
+
+    On builds of Python with a global interpreter lock, expect the
+    time per operation to grow with the threads rather than shrink.
+    """
+
+    def setup(threads, size):
+        mapping = factory()
+        keys = sample(make_keys(size))
+        parts = [keys[start::threads] for start in range(threads)]
+        executor = concurrent.futures.ThreadPoolExecutor(threads)
+        operation = functools.partial(operate, mapping)
+
+        def run():
+            return list(executor.map(operation, parts))
+
+        run.close = executor.shutdown  # type: ignore[attr-defined]
+        return run, len(keys)
+
+    for threads in thread_counts:
+        case(f'{name}.threads-{threads}', baseline)(functools.partial(setup, threads))
+        baseline = f'{name}.threads-1'
+
+
+threaded(
+    'FoldedCaseKeyedDict.set_and_get',
+    FoldedCaseKeyedDict,
+    set_and_get,
+    [1],
+)
+threaded(
+    'ConcurrentFoldedCaseKeyedDict.set_and_get',
+    ConcurrentFoldedCaseKeyedDict,
+    set_and_get,
+    [1, 2, 4, 8],
+    baseline='FoldedCaseKeyedDict.set_and_get.threads-1',
+)
+threaded(
+    'FreezableDefaultDict.pop_and_default',
+    functools.partial(FreezableDefaultDict, list),
+    pop_and_default,
+    [1],
+)
+threaded(
+    'ConcurrentFreezableDefaultDict.pop_and_default',
+    functools.partial(ConcurrentFreezableDefaultDict, list),
+    pop_and_default,
+    [1, 2, 4, 8],
+    baseline='FreezableDefaultDict.pop_and_default.threads-1',
+)
+
+
+def measure(setup, size: int, repeat: int) -> float:
+    """
+    Return the best time, in seconds, per operation.
+    """
+    function, operations = setup(size)
+    try:
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        return min(timer.repeat(repeat, number)) / number / operations
+    finally:
+        getattr(function, 'close', lambda: None)()
+
+
+def run(names, sizes, repeat):
+    results: dict[str, dict[str, float]] = {}
+    for name in names:
+        results[name] = {}
+        for size in sizes:
+            results[name][str(size)] = measure(cases[name].setup, size, repeat)
+            report(name, size, results)
+    return results
+
+
+def report(name, size, results):
+    elapsed = results[name][str(size)]
+    baseline = cases[name].baseline
+    relative = ''
+    if str(size) in results.get(baseline, {}):
+        relative = f'{elapsed / results[baseline][str(size)]:8.2f}x {baseline}'
+    print(f'{name:56} {size:>9} {elapsed * 1e9:12.1f} ns {relative}', flush=True)
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Generate descriptions of cases slower than in the baseline
+    by more than the tolerance.
+    """
+    for name, timings in results.items():
+        for size, elapsed in timings.items():
+            try:
+                previous = baseline['results'][name][size]
+            except KeyError:
+                continue
+            if elapsed > previous * (1 + tolerance):
+                yield f'{name} ({size}): {elapsed / previous:.2f}x baseline'
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.partition('\n\n')[0])
+    parser.add_argument('--max-size', type=int, default=max(sizes))
+    parser.add_argument(
+        '--case',
+        action='append',
+        dest='cases',
+        help="run only cases whose name includes this text (may be repeated)",
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare with the results in this file")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    options = parser.parse_args(args)
+    names = [
+        name
+        for name in cases
+        if not options.cases or any(text in name for text in options.cases)
+    ]
+    # include the baselines for comparison
+    names = list(
+        dict.fromkeys(
+            [baseline for name in names if (baseline := cases[name].baseline)] + names
+        )
+    )
+    selected_sizes = [size for size in sizes if size <= options.max_size]
+    results = run(names, selected_sizes, options.repeat)
+    document = dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        results=results,
+    )
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump(document, file, indent=2)
+    if options.baseline:
+        with open(options.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        found = list(regressions(results, baseline, options.tolerance))
+        for regression in found:
+            print('Regression:', regression)
+        if found:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,23 @@
 from __future__ import annotations
 
+import array
+import bisect
 import collections.abc
+import contextlib
 import copy
 import functools
+import heapq
 import itertools
+import mmap
 import operator
+import pickle
 import random
 import re
-from collections.abc import Container, Iterable, Mapping
+import struct
+import sys
+import threading
+from collections.abc import Container, Iterable, Iterator, Mapping, Sequence
+from random import Random
 from typing import TYPE_CHECKING, Any, Callable, TypeVar, Union, overload
 
 import jaraco.text
@@ -15,7 +25,7 @@ import jaraco.text
 if TYPE_CHECKING:
     from _operator import _SupportsComparison
 
-    from _typeshed import SupportsKeysAndGetItem
+    from _typeshed import StrPath, SupportsKeysAndGetItem
     from typing_extensions import Self
 
     _RangeMapKT = TypeVar('_RangeMapKT', bound=_SupportsComparison)
@@ -44,6 +54,168 @@ def _dispatch(obj: _Matchable) -> Callable:
     return obj  # type: ignore[return-value]
 
 
+# builtin collections, whose membership agrees with their iteration
+_finite_types: tuple[type, ...] = (list, tuple, set, frozenset, dict, type({}.keys()))
+
+
+def _finite_keys(match: Callable) -> collections.abc.Collection | None:
+    """
+    Return the builtin collection whose membership test is match,
+    if any, so its keys may be enumerated instead of tested.
+
+    >>> _finite_keys(_dispatch(['a', 'b']))
+    ['a', 'b']
+    >>> _finite_keys(_dispatch(iter('ab'))) == {'a', 'b'}
+    True
+
+    Strings test for substrings, not just their characters, and
+    other collections may have their own rules for membership.
+
+    >>> _finite_keys(_dispatch('ab'))
+    >>> _finite_keys(_dispatch(FoldedCaseKeyedDict(a=1)))
+    >>> _finite_keys(str.isupper)
+    """
+    keys = getattr(match, '__self__', None)
+    if (
+        getattr(match, '__name__', None) != '__contains__'
+        or type(keys) not in _finite_types
+    ):
+        return None
+    return keys
+
+
+def _distinct(keys: collections.abc.Collection) -> Iterable:
+    if isinstance(keys, (collections.abc.Set, Mapping)):
+        return keys
+    return dict.fromkeys(keys)
+
+
+def _materialize(obj: _Matchable) -> _Matchable:
+    """
+    Collect an iterable of keys that can't test for membership,
+    leaving other matchables as they are.
+    """
+    if isinstance(obj, (re.Pattern, Container)) or callable(obj):
+        return obj
+    return set(obj)
+
+
+class _Predicates(tuple):
+    def __new__(cls, predicates: Iterable[Callable]):
+        # flatten any of the same kind
+        nested = (
+            predicate if type(predicate) is cls else (predicate,)
+            for predicate in predicates
+        )
+        return super().__new__(cls, itertools.chain.from_iterable(nested))
+
+
+class _All(_Predicates):
+    """
+    A predicate matching keys matched by all of the predicates.
+
+    >>> _All([str.islower, _All([str.isalpha])])('abc')
+    True
+    >>> len(_All([str.islower, _All([str.isalpha])]))
+    2
+    """
+
+    def __call__(self, key) -> bool:
+        return all(predicate(key) for predicate in self)
+
+
+class _Any(_Predicates):
+    """
+    A predicate matching keys matched by any of the predicates.
+    """
+
+    def __call__(self, key) -> bool:
+        return any(predicate(key) for predicate in self)
+
+
+class _Not:
+    """
+    A predicate matching keys not matched by the predicate.
+    """
+
+    def __init__(self, predicate: Callable):
+        self.predicate = predicate
+
+    def __call__(self, key) -> bool:
+        return not self.predicate(key)
+
+
+def _intersection(first: _Matchable, second: _Matchable) -> _Matchable:
+    for keys, other in (first, second), (second, first):
+        finite = _finite_keys(_dispatch(keys))
+        if finite is not None:
+            match = _dispatch(other)
+            return [key for key in _distinct(finite) if match(key)]
+    return _All([_dispatch(first), _dispatch(second)])
+
+
+def _union(first: _Matchable, second: _Matchable) -> _Matchable:
+    keys = _finite_keys(_dispatch(first))
+    other = _finite_keys(_dispatch(second))
+    if keys is not None and other is not None:
+        return dict.fromkeys(itertools.chain(keys, other))
+    if isinstance(first, re.Pattern) and isinstance(second, re.Pattern):
+        with contextlib.suppress(re.error, TypeError):
+            # an alternation would renumber any groups, breaking backreferences
+            if first.flags == second.flags and not first.groups + second.groups:
+                alternation = type(first.pattern)('(?:%s)|(?:%s)')
+                return re.compile(
+                    alternation % (first.pattern, second.pattern), first.flags
+                )
+    return _Any([_dispatch(first), _dispatch(second)])
+
+
+def _difference(first: _Matchable, second: _Matchable) -> _Matchable:
+    finite = _finite_keys(_dispatch(first))
+    match = _dispatch(second)
+    if finite is not None:
+        return [key for key in _distinct(finite) if not match(key)]
+    return _All([_dispatch(first), _Not(match)])
+
+
+def _combine(
+    first: tuple[_Matchable, bool], second: tuple[_Matchable, bool], conjunction: bool
+) -> tuple[_Matchable, bool]:
+    """
+    Combine matchables, each flagged as including (or excluding) the
+    keys it matches, into one matching the keys both (or either)
+    include, and whether that one includes those keys.
+
+    Finite collections are combined into one and patterns into
+    an alternation, where possible.
+
+    >>> _combine((['a', 'b'], True), (['b', 'c'], True), True)
+    (['b'], True)
+    >>> _combine((['a', 'b'], True), (['b', 'c'], True), False)
+    ({'a': None, 'b': None, 'c': None}, True)
+    >>> _combine((['a', 'b'], True), (['b', 'c'], False), True)
+    (['a'], True)
+    >>> _combine((['a', 'b'], True), (['b', 'c'], False), False)
+    (['c'], False)
+    >>> _combine((re.compile('a'), False), (re.compile('b'), False), True)
+    (re.compile('(?:a)|(?:b)'), False)
+    """
+    (keys, include), (other, other_include) = first, second
+    if not conjunction:
+        # per De Morgan
+        keys, include = _combine(
+            (keys, not include), (other, not other_include), conjunction=True
+        )
+        return keys, not include
+    if include and other_include:
+        return _intersection(keys, other), True
+    if not include and not other_include:
+        return _union(keys, other), False
+    if include:
+        return _difference(keys, other), True
+    return _difference(other, keys), True
+
+
 class Projection(collections.abc.Mapping):
     """
     Project a set of keys over a mapping
@@ -88,25 +260,213 @@ class Projection(collections.abc.Mapping):
     >>> del sample['a']
     >>> dict(prj)
     {'c': 3}
+
+    When the keys are a builtin collection (a list, tuple, set,
+    frozenset, dict or keys view) with fewer keys than a dict space,
+    each is looked up in the space rather than every key in the
+    space tested, and the projection follows the order of the keys.
+
+    >>> prj = Projection(['c', 'b', 'z'], dict(a=1, b=2, c=3, d=4))
+    >>> len(prj)
+    2
+    >>> list(prj)
+    ['c', 'b']
+
+    Projections and masks of the same space combine by intersection
+    (``&``) or union (``|``) of their keys, and ``~`` inverts one.
+    Views of views combine likewise, so each tests its keys once.
+
+    >>> space = dict(a=1, b=2, c=3, d=4)
+    >>> dict(Projection(['a', 'b', 'c'], space) & Mask(['b'], space))
+    {'a': 1, 'c': 3}
+    >>> dict(Projection(['a'], space) | Projection(re.compile('[cd]'), space))
+    {'a': 1, 'c': 3, 'd': 4}
+    >>> dict(~Projection(['a'], space))
+    {'b': 2, 'c': 3, 'd': 4}
+    >>> nested = Projection(['a', 'b'], Mask(['a', 'c'], space))
+    >>> dict(nested), nested._space is space
+    ({'b': 2}, True)
+
+    Only views of the same space may be combined.
+
+    >>> Projection(['a'], space) & Projection(['a'], dict(space))
+    Traceback (most recent call last):
+    ...
+    ValueError: Only views of the same space may be combined
+
+    Supply a ``cache_key`` function of the space, such as ``len``,
+    to memoize the keys resolved until its result changes. It
+    should change whenever the keys of the space do.
+
+    >>> prj = Projection(str.islower, sample, cache_key=len)
+    >>> len(prj)
+    2
+    >>> sample['d'] = 4
+    >>> list(prj)
+    ['b', 'c', 'd']
     """
 
-    def __init__(self, keys: _Matchable, space: Mapping):
+    def __init__(
+        self,
+        keys: _Matchable,
+        space: Mapping,
+        *,
+        cache_key: Callable[[Mapping], object] | None = None,
+    ):
+        keys = _materialize(keys)
+        if isinstance(space, Projection):
+            keys, include = _combine(
+                (keys, self._include),
+                (space._matchable, space._include),
+                conjunction=True,
+            )
+            if include is not self._include:
+                keys = _Not(_dispatch(keys))
+            space = space._space
+        self._matchable = keys
         self._match = _dispatch(keys)
+        self._keys = _finite_keys(self._match)
         self._space = space
+        self._cache_key = cache_key
+        self._cache: tuple[object, tuple] | None = None
+
+    _matchable: _Matchable
+    _space: Mapping
+
+    # whether the view includes (rather than excludes) the keys
+    _include = True
+
+    def _combined(self, other, conjunction):
+        if not isinstance(other, Projection):
+            return NotImplemented
+        if other._space is not self._space:
+            raise ValueError("Only views of the same space may be combined")
+        keys, include = _combine(
+            (self._matchable, self._include),
+            (other._matchable, other._include),
+            conjunction,
+        )
+        return self._view(keys, include)
+
+    def _view(self, keys, include):
+        cls = Projection if include else Mask
+        return cls(keys, self._space, cache_key=self._cache_key)
+
+    def __and__(self, other):
+        return self._combined(other, conjunction=True)
+
+    def __or__(self, other):
+        return self._combined(other, conjunction=False)
+
+    def __invert__(self):
+        return self._view(self._matchable, not self._include)
 
     def __getitem__(self, key):
         if not self._match(key):
             raise KeyError(key)
         return self._space[key]
 
+    def _probed(self) -> collections.abc.Collection | None:
+        """
+        The finite keys, if there are fewer of them than keys in the
+        space and the space is a dict whose membership agrees with
+        its iteration, so each may be looked up rather than the space
+        scanned.
+        """
+        keys, space = self._keys, self._space
+        if (
+            keys is None
+            or not isinstance(space, dict)
+            or type(space).__contains__ is not dict.__contains__
+            or type(space).__iter__ is not dict.__iter__
+            or len(keys) >= len(space)
+        ):
+            return None
+        return keys
+
     def _keys_resolved(self):
-        return filter(self._match, self._space)
+        keys = self._probed()
+        if keys is None:
+            return filter(self._match, self._space)
+        return filter(self._space.__contains__, _distinct(keys))
+
+    def _resolved(self) -> tuple:
+        """
+        Resolve the keys, memoized while the cache key is unchanged.
+        """
+        if self._cache_key is None:
+            return tuple(self._keys_resolved())
+        check = self._cache_key(self._space)
+        if self._cache is None or self._cache[0] != check:
+            self._cache = check, tuple(self._keys_resolved())
+        return self._cache[1]
 
     def __iter__(self):
-        return self._keys_resolved()
+        if self._cache_key is None:
+            return self._keys_resolved()
+        return iter(self._resolved())
 
     def __len__(self):
-        return len(tuple(self._keys_resolved()))
+        keys = self._probed()
+        if self._cache_key is not None or keys is None:
+            return len(self._resolved())
+        return sum(map(self._space.__contains__, _distinct(keys)))
+
+    @classmethod
+    def compile(cls, keys: _Matchable) -> Callable[[Mapping], dict]:
+        """
+        Compile the keys into a function returning the projection of
+        them over any mapping as a dict, for projecting the same keys
+        over many mappings without a view of each.
+
+        >>> project = Projection.compile(['a', 'c'])
+        >>> project(dict(a=1, b=2, c=3))
+        {'a': 1, 'c': 3}
+        >>> project(dict(b=2, c=3))
+        {'c': 3}
+        >>> Projection.compile(str.isupper)(dict(a=1, B=2))
+        {'B': 2}
+
+        The keys are resolved when compiled, so a finite collection
+        of them is fetched from each dict all at once.
+        """
+        match = _dispatch(keys)
+        finite = _finite_keys(match)
+        if finite is None:
+            return lambda space: {
+                key: value for key, value in space.items() if match(key)
+            }
+        selected = tuple(_distinct(finite))
+        getter = (
+            operator.itemgetter(*selected)
+            if len(selected) > 1
+            else lambda space: tuple(space[key] for key in selected)
+        )
+
+        def project(space):
+            # a plain dict has no __missing__ to supply absent keys
+            if type(space) is dict:
+                try:
+                    return dict(zip(selected, getter(space)))
+                except KeyError:
+                    pass
+            return {key: space[key] for key in selected if key in space}
+
+        return project
+
+    @classmethod
+    def apply_many(cls, keys: _Matchable, spaces: Iterable[Mapping]) -> Iterator[dict]:
+        """
+        Generate the projection of the keys over each of the mappings
+        as a dict.
+
+        >>> records = [dict(a=1, b=2), dict(b=3, c=4)]
+        >>> list(Projection.apply_many(re.compile('[ab]'), records))
+        [{'a': 1, 'b': 2}, {'b': 3}]
+        >>> list(Mask.apply_many(['a'], records))
+        [{'b': 2}, {'b': 3, 'c': 4}]
+        """
+        return map(cls.compile(keys), spaces)
 
 
 class Mask(Projection):
@@ -117,24 +477,217 @@ class Mask(Projection):
     >>> msk = Mask(['a', 'c', 'd'], sample)
     >>> dict(msk)
     {'b': 2}
+
+    The length of a mask of a finite collection of keys is
+    the size of the space less that of the keys in it.
+
+    >>> len(msk)
+    1
     """
 
+    _include = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # self._match = compose(operator.not_, self._match)
-        self._match = lambda key, orig=self._match: not orig(key)
+        self._match = _Not(self._match)
+
+    @classmethod
+    def compile(cls, keys: _Matchable) -> Callable[[Mapping], dict]:
+        """
+        Compile the keys into a function returning the mask of them
+        over any mapping as a dict.
+
+        >>> Mask.compile(['a', 'c'])(dict(a=1, b=2, c=3))
+        {'b': 2}
+        """
+        match = _dispatch(keys)
+        finite = _finite_keys(match)
+        if finite is not None:
+            with contextlib.suppress(TypeError):
+                match = frozenset(finite).__contains__
+        return lambda space: {
+            key: value for key, value in space.items() if not match(key)
+        }
+
+    def _keys_resolved(self):
+        return filter(self._match, self._space)
+
+    def __len__(self):
+        keys = self._probed()
+        if self._cache_key is not None or keys is None:
+            return len(self._resolved())
+        return len(self._space) - sum(map(self._space.__contains__, _distinct(keys)))
 
 
-def dict_map(function, dictionary):
+def dict_map(function, dictionary, *, executor=None, chunksize=1):
     """
     Return a new dict with function applied to values of dictionary.
 
     >>> dict_map(lambda x: x+1, dict(a=1, b=2))
     {'a': 2, 'b': 3}
+
+    Supply a :class:`concurrent.futures.Executor` to apply the
+    function in its threads or processes, in chunks of ``chunksize``
+    values for a process pool.
+
+    >>> import concurrent.futures
+    >>> with concurrent.futures.ThreadPoolExecutor(2) as executor:
+    ...     dict_map(abs, dict(a=-1, b=2), executor=executor)
+    {'a': 1, 'b': 2}
+
+    See :class:`MappedView` to apply the function only to the
+    values accessed.
     """
+    if executor is not None:
+        values = executor.map(function, dictionary.values(), chunksize=chunksize)
+        return dict(zip(dictionary, values))
     return dict((key, function(value)) for key, value in dictionary.items())
 
 
+class MappedView(collections.abc.Mapping):
+    """
+    A view of a mapping with function applied to the values
+    as they're accessed, remembering the result for each key.
+
+    >>> calls = []
+    >>> def square(value):
+    ...     calls.append(value)
+    ...     return value ** 2
+    >>> source = dict(a=1, b=2, c=3)
+    >>> view = MappedView(square, source)
+    >>> view['b'], view['b']
+    (4, 4)
+    >>> calls
+    [2]
+    >>> len(view), list(view)
+    (3, ['a', 'b', 'c'])
+
+    The view reflects the mapping, applying the function again
+    to any value replaced there (but not to values changed in place).
+
+    >>> source['b'] = 5
+    >>> view['b']
+    25
+    >>> del source['a']
+    >>> dict(view)
+    {'b': 25, 'c': 9}
+    >>> calls
+    [2, 5, 3]
+
+    Results for keys since removed from the mapping are dropped when
+    next looked up, or once they outnumber the keys in the mapping.
+    """
+
+    def __init__(self, function: Callable, mapping: Mapping):
+        self._function = function
+        self._mapping = mapping
+        # key: (value in the mapping, result)
+        self._results: dict = {}
+
+    def __getitem__(self, key):
+        try:
+            value = self._mapping[key]
+        except KeyError:
+            self._results.pop(key, None)
+            raise
+        try:
+            source, result = self._results[key]
+        except KeyError:
+            self._prune()
+        else:
+            if source is value:
+                return result
+        result = self._function(value)
+        self._results[key] = value, result
+        return result
+
+    def _prune(self):
+        # sweep only once the results outnumber the keys by half, so
+        # the sweeps cost O(1) per result remembered
+        if len(self._results) * 2 > len(self._mapping) * 3:
+            self._results = {
+                key: entry
+                for key, entry in self._results.items()
+                if key in self._mapping
+            }
+
+    def __contains__(self, key):
+        return key in self._mapping
+
+    def __iter__(self):
+        return iter(self._mapping)
+
+    def __len__(self):
+        return len(self._mapping)
+
+
+def _bisect_first(keys: Sequence, is_match: Callable[[Any], bool]) -> int:
+    """
+    Return the index of the first of keys satisfying is_match,
+    or len(keys) if none do.
+
+    Assumes is_match is monotonic over keys (false for some
+    prefix and true for the remainder).
+
+    >>> _bisect_first([1, 3, 5], lambda key: key > 2)
+    1
+    >>> _bisect_first([1, 3, 5], lambda key: key > 5)
+    3
+    """
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if is_match(keys[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+_ascending_bisectors = {
+    operator.le: bisect.bisect_left,
+    operator.lt: bisect.bisect_right,
+}
+
+
+def _range_bisector(
+    match: Callable, sort_params: Mapping[str, Any]
+) -> Callable[[Sequence, Any], int] | None:
+    """
+    Return a function locating the index of the first key matching
+    an item in keys sorted by sort_params, or None if the comparator
+    can't be trusted to agree with that order (in which case keys
+    must be scanned).
+
+    >>> _range_bisector(operator.le, {})([3, 6], 4)
+    1
+    >>> _range_bisector(operator.ge, dict(reverse=True))([6, 3], 4)
+    1
+    >>> _range_bisector(operator.ge, {}) is None
+    True
+    >>> _range_bisector(operator.le, dict(key=abs)) is None
+    True
+    """
+    if sort_params.get('key') is not None or not set(sort_params) <= {
+        'key',
+        'reverse',
+    }:
+        return None
+    if not sort_params.get('reverse'):
+        return _ascending_bisectors.get(match)
+    if match not in (operator.ge, operator.gt):
+        return None
+    return functools.partial(_bisect_descending, match)
+
+
+def _bisect_descending(match: Callable, keys: Sequence, item) -> int:
+    return _bisect_first(keys, functools.partial(match, item))
+
+
+def _prefer_defined(mine, theirs):
+    return mine if theirs is RangeMap.undefined_value else theirs
+
+
 class RangeMap(dict[_RangeMapKT, _VT]):
     """
     A dictionary-like object that uses the keys as bounds for a range.
@@ -214,6 +767,19 @@ class RangeMap(dict[_RangeMapKT, _VT]):
     >>> r[1], r[2], r[3], r[4], r[5], r[6]
     ('a', 'a', 'a', 'b', 'b', 'b')
 
+    The keys are sorted once and retained until the map is next
+    modified. For the stock comparators (``operator.le`` and
+    ``operator.lt`` over ascending keys, ``operator.ge`` and
+    ``operator.gt`` over descending keys), lookups use a binary
+    search over those keys; any other key_match_comparator or sort
+    key falls back to a scan for the first match.
+
+    >>> r[7] = 'c'
+    >>> r[8]
+    'c'
+    >>> del r[1]
+    >>> r.get(2, 'not found')
+    'not found'
     """
 
     def __init__(
@@ -240,11 +806,14 @@ class RangeMap(dict[_RangeMapKT, _VT]):
         )
 
     def __getitem__(self, item: _RangeMapKT) -> _VT:
-        sorted_keys = sorted(self.keys(), **self.sort_params)
+        sorted_keys, bisector = self._get_index_()
         if isinstance(item, RangeMap.Item):
             result = self.__getitem__(sorted_keys[item])
         else:
-            key = self._find_first_match_(sorted_keys, item)
+            if bisector is None:
+                key = self._find_first_match_(sorted_keys, item)
+            else:
+                key = self._key_at_(sorted_keys, bisector(sorted_keys, item), item)
             result = dict.__getitem__(self, key)
             if result is RangeMap.undefined_value:
                 raise KeyError(key)
@@ -265,6 +834,258 @@ class RangeMap(dict[_RangeMapKT, _VT]):
         except KeyError:
             return default
 
+    def get_many(self, items: Iterable[_RangeMapKT], default: _T | None = None):
+        """
+        Return the value for each of items, as :meth:`get` would,
+        resolving them all in one pass.
+
+        >>> r = RangeMap({0: RangeMap.undefined_value, 3: 'a', 6: 'b'})
+        >>> r.get_many([4, 7, 0, 1], 'not found')
+        ['b', 'not found', 'not found', 'a']
+
+        Items in the same order as the keys are resolved by walking
+        the keys alongside them rather than searching for each.
+
+        >>> r.get_many(range(8))
+        [None, 'a', 'a', 'a', 'b', 'b', 'b', None]
+        >>> RangeMap.left({1: 'a', 4: 'b'}).get_many([5, 4, 3, 0])
+        ['b', 'b', 'a', None]
+
+        If items is a NumPy array, the lookups are vectorized
+        (using ``searchsorted``) and the values are returned
+        as an array of objects.
+        """
+        numpy = sys.modules.get('numpy')
+        if numpy is not None and isinstance(items, numpy.ndarray):
+            return self._get_many_array_(numpy, items, default)
+        items = list(items)
+        sorted_keys, bisector = self._get_index_()
+        # walking the keys beats a search per item when there are enough items
+        walk_cheaper = len(items) * len(sorted_keys).bit_length() > len(sorted_keys)
+        positions: Iterable[int]
+        if bisector is None:
+            positions = map(self._locate_, items)
+        elif walk_cheaper and self._in_order_(items):
+            positions = self._walk_(sorted_keys, items)
+        else:
+            positions = (bisector(sorted_keys, item) for item in items)
+        resolve = functools.partial(self._resolve_, sorted_keys, default)
+        return list(map(resolve, positions))
+
+    def ranges(
+        self, lo: _RangeMapKT | None = None, hi: _RangeMapKT | None = None
+    ) -> Iterator[tuple[_RangeMapKT | None, _RangeMapKT | None, _VT]]:
+        """
+        Generate ``(start, end, value)`` for each range, from lowest to
+        highest, where start and end are the bounding keys (or None
+        where the range is open-ended). Ranges with undefined values
+        are omitted.
+
+        >>> r = RangeMap({0: RangeMap.undefined_value, 3: 'a', 6: 'b', 9: 'c'})
+        >>> list(r.ranges())
+        [(0, 3, 'a'), (3, 6, 'b'), (6, 9, 'c')]
+        >>> list(RangeMap.left({1: 'a', 4: 'b', 7: 'c'}).ranges())
+        [(1, 4, 'a'), (4, 7, 'b'), (7, None, 'c')]
+
+        Supply lo and/or hi to generate only the ranges intersecting
+        ``[lo, hi)``. The first is found by the same search as a lookup.
+
+        >>> list(r.ranges(4, 7))
+        [(3, 6, 'b'), (6, 9, 'c')]
+        >>> list(r.ranges(hi=6))
+        [(0, 3, 'a'), (3, 6, 'b')]
+        >>> list(r.ranges(lo=10))
+        []
+        """
+        keys, _ = self._get_index_()
+        count = len(keys)
+        reverse = bool(self.sort_params.get('reverse'))
+        sort_key = self.sort_params.get('key') or (lambda key: key)
+        if lo is None:
+            first = 0
+        elif reverse:
+            first = max(count - 1 - self._locate_(lo), 0)
+        else:
+            first = self._locate_(lo)
+        for index in range(first, count):
+            start: _RangeMapKT | None
+            end: _RangeMapKT | None
+            if reverse:
+                key = start = keys[count - 1 - index]
+                end = keys[count - 2 - index] if index < count - 1 else None
+            else:
+                start = keys[index - 1] if index else None
+                key = end = keys[index]
+            if (
+                hi is not None
+                and start is not None
+                and not sort_key(start) < sort_key(hi)
+            ):
+                return
+            value = dict.__getitem__(self, key)
+            if value is not RangeMap.undefined_value:
+                yield start, end, value
+
+    def coalesce(self) -> Self:
+        """
+        Return an equivalent map without redundant keys: those whose
+        value matches that of the adjacent range into which they
+        can be folded, and those leaving only undefined ranges at
+        the open end. This relies on the ranges following the sort
+        order, as they do with the stock comparators.
+
+        >>> r = RangeMap({1: 'a', 2: 'a', 3: 'b', 4: 'b', 5: 'a'})
+        >>> r.coalesce()
+        {2: 'a', 4: 'b', 5: 'a'}
+        >>> RangeMap.left({1: 'a', 2: 'a', 3: 'b', 4: 'b'}).coalesce()
+        {3: 'b', 1: 'a'}
+        >>> undefined = RangeMap.undefined_value
+        >>> RangeMap({0: undefined, 3: 'a', 6: undefined}).coalesce().bounds()
+        (0, 3)
+        """
+        sorted_keys, _ = self._get_index_()
+        values = (dict.__getitem__(self, key) for key in sorted_keys)
+        return self._derive_(self._coalesce_(zip(sorted_keys, values)))
+
+    def merge(
+        self, other: RangeMap, resolve: Callable[[Any, Any], Any] | None = None
+    ) -> Self:
+        """
+        Overlay other on this map, returning a new (coalesced) map
+        that resolves each item to ``resolve(mine, theirs)``, given
+        the values this map and other resolve it to (or
+        ``RangeMap.undefined_value`` where they have none). By default,
+        the value from other prevails where it's defined.
+
+        >>> base = RangeMap({0: RangeMap.undefined_value, 10: 'low', 20: 'high'})
+        >>> patch = RangeMap({5: RangeMap.undefined_value, 15: 'mid'})
+        >>> list(base.merge(patch).ranges())
+        [(0, 5, 'low'), (5, 15, 'mid'), (15, 20, 'high')]
+        >>> combine = lambda mine, theirs: (mine, theirs)
+        >>> merged = RangeMap.left({1: 'a'}).merge(RangeMap.left({2: 'b'}), combine)
+        >>> merged[1] == ('a', RangeMap.undefined_value)
+        True
+        >>> merged[2]
+        ('a', 'b')
+
+        Both maps must share the sort params and comparator.
+        The keys of each are walked together in a single pass.
+
+        Like :meth:`coalesce`, this relies on the ranges following
+        the sort order.
+        """
+        if (self.sort_params, self.match) != (other.sort_params, other.match):
+            raise ValueError("Maps must share sort params and comparator")
+        if resolve is None:
+            resolve = _prefer_defined
+        mine, _ = self._get_index_()
+        theirs, _ = other._get_index_()
+        sort_key = self.sort_params.get('key') or (lambda key: key)
+        before = operator.gt if self.sort_params.get('reverse') else operator.lt
+
+        def precedes(key, other_key):
+            return before(sort_key(key), sort_key(other_key))
+
+        def advance(keys, index, key):
+            while index < len(keys) and precedes(keys[index], key):
+                index += 1
+            return index
+
+        def merged():
+            previous = None
+            mine_index = theirs_index = 0
+            undefined = RangeMap.undefined_value
+            for key in heapq.merge(mine, theirs, **self.sort_params):
+                if previous is not None and not precedes(previous, key):
+                    # the same key appears in both
+                    continue
+                previous = key
+                mine_index = advance(mine, mine_index, key)
+                theirs_index = advance(theirs, theirs_index, key)
+                ours = self._resolve_(mine, undefined, mine_index)
+                yours = other._resolve_(theirs, undefined, theirs_index)
+                yield key, resolve(ours, yours)
+
+        return self._derive_(self._coalesce_(merged()))
+
+    @staticmethod
+    def _coalesce_(items: Iterable[tuple[_RangeMapKT, _VT]]):
+        """
+        Given items in key order, fold each into the next if the
+        values match, and drop undefined ones left at the end.
+        """
+        result: list[tuple[_RangeMapKT, _VT]] = []
+        for key, value in items:
+            if result and result[-1][1] == value:
+                result[-1] = key, value
+            else:
+                result.append((key, value))
+        while result and result[-1][1] is RangeMap.undefined_value:
+            result.pop()
+        return result
+
+    def _derive_(self, items: Iterable[tuple[_RangeMapKT, _VT]]) -> Self:
+        """
+        Return a map like this one but with items.
+        """
+        derived = type(self).__new__(type(self))
+        vars(derived).update(vars(self), _index=None)
+        dict.update(derived, items)
+        return derived
+
+    def save(self, path: StrPath) -> None:
+        """
+        Write the map to path, such that it may be memory-mapped by
+        :meth:`open`. See :meth:`FrozenRangeMap.save`.
+        """
+        FrozenRangeMap.from_range_map(self).save(path)
+
+    @staticmethod
+    def open(path: StrPath) -> FrozenRangeMap:
+        """
+        Open a map saved by :meth:`save` as a :class:`FrozenRangeMap`
+        searching the file in place. See :meth:`FrozenRangeMap.open`.
+        """
+        return FrozenRangeMap.open(path)
+
+    def _resolve_(self, keys: Sequence[_RangeMapKT], default, index: int):
+        if index == len(keys):
+            return default
+        value = dict.__getitem__(self, keys[index])
+        return default if value is RangeMap.undefined_value else value
+
+    def _in_order_(self, items: list[_RangeMapKT]) -> bool:
+        """
+        Are items ordered (non-strictly) as the keys are?
+        """
+        in_order = operator.ge if self.sort_params.get('reverse') else operator.le
+        return all(map(in_order, items, itertools.islice(items, 1, None)))
+
+    def _walk_(self, keys: Sequence[_RangeMapKT], items: Iterable[_RangeMapKT]):
+        """
+        Locate each of items (in key order) by advancing through keys.
+        """
+        index = 0
+        for item in items:
+            while index < len(keys) and not self.match(item, keys[index]):
+                index += 1
+            yield index
+
+    def _get_many_array_(self, numpy, items, default):
+        sorted_keys, bisector = self._get_index_()
+        if bisector is None:
+            return numpy.array(self.get_many(items.tolist(), default), dtype=object)
+        table = numpy.empty(len(sorted_keys) + 1, dtype=object)
+        table[:] = [
+            self._resolve_(sorted_keys, default, index)
+            for index in range(len(sorted_keys) + 1)
+        ]
+        side = 'left' if self.match in (operator.le, operator.gt) else 'right'
+        if not self.sort_params.get('reverse'):
+            return table[numpy.searchsorted(numpy.array(sorted_keys), items, side)]
+        ascending = numpy.array(sorted_keys[::-1])
+        return table[len(sorted_keys) - numpy.searchsorted(ascending, items, side)]
+
     def _find_first_match_(
         self, keys: Iterable[_RangeMapKT], item: _RangeMapKT
     ) -> _RangeMapKT:
@@ -275,12 +1096,92 @@ class RangeMap(dict[_RangeMapKT, _VT]):
         except StopIteration:
             raise KeyError(item) from None
 
+    @staticmethod
+    def _key_at_(
+        keys: Sequence[_RangeMapKT], index: int, item: _RangeMapKT
+    ) -> _RangeMapKT:
+        try:
+            return keys[index]
+        except IndexError:
+            raise KeyError(item) from None
+
+    def _locate_(self, item: _RangeMapKT) -> int:
+        """
+        Return the position in the sorted keys of the first key
+        matching item, or the number of keys if none match.
+        """
+        sorted_keys, bisector = self._get_index_()
+        if bisector is not None:
+            return bisector(sorted_keys, item)
+        is_match = functools.partial(self.match, item)
+        matches = (index for index, key in enumerate(sorted_keys) if is_match(key))
+        return next(matches, len(sorted_keys))
+
     def bounds(self) -> tuple[_RangeMapKT, _RangeMapKT]:
-        sorted_keys = sorted(self.keys(), **self.sort_params)
+        sorted_keys, _ = self._get_index_()
         return (sorted_keys[RangeMap.first_item], sorted_keys[RangeMap.last_item])
 
+    # the sorted keys and the binary search suitable for them (if any),
+    # built on demand and discarded whenever the dict is modified.
+    _index: tuple[list[_RangeMapKT], Callable[[Sequence, Any], int] | None] | None = (
+        None
+    )
+
+    def _get_index_(
+        self,
+    ) -> tuple[list[_RangeMapKT], Callable[[Sequence, Any], int] | None]:
+        if self._index is None:
+            self._index = (
+                sorted(self.keys(), **self.sort_params),
+                _range_bisector(self.match, self.sort_params),
+            )
+        return self._index
+
+    def __getstate__(self):
+        # the index is derived, so is rebuilt rather than kept
+        state = vars(self).copy()
+        state.pop('_index', None)
+        return state
+
+    def __setitem__(self, key: _RangeMapKT, value: _VT) -> None:
+        self._index = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: _RangeMapKT) -> None:
+        self._index = None
+        super().__delitem__(key)
+
+    def __ior__(self, other):  # type: ignore[misc]
+        self._index = None
+        return super().__ior__(other)
+
+    def pop(self, *args):
+        self._index = None
+        return super().pop(*args)
+
+    def popitem(self) -> tuple[_RangeMapKT, _VT]:
+        self._index = None
+        return super().popitem()
+
+    def setdefault(self, *args):
+        self._index = None
+        return super().setdefault(*args)
+
+    def update(self, *args, **kwargs) -> None:
+        self._index = None
+        super().update(*args, **kwargs)
+
+    def clear(self) -> None:
+        self._index = None
+        super().clear()
+
     # some special values for the RangeMap
-    undefined_value = type('RangeValueUndefined', (), {})()
+    undefined_value = type(
+        'RangeValueUndefined',
+        (),
+        # pickle and copy by reference, retaining identity
+        dict(__reduce__=lambda self: 'RangeMap.undefined_value'),
+    )()
 
     class Item(int):
         """RangeMap Item"""
@@ -289,168 +1190,1271 @@ class RangeMap(dict[_RangeMapKT, _VT]):
     last_item = Item(-1)
 
 
-def __identity(x):
-    return x
-
-
-def sorted_items(d, key=__identity, reverse=False):
+def _compact(keys: list) -> Sequence:
     """
-    Return the items of the dictionary sorted by the keys.
-
-    >>> sample = dict(foo=20, bar=42, baz=10)
-    >>> tuple(sorted_items(sample))
-    (('bar', 42), ('baz', 10), ('foo', 20))
-
-    >>> reverse_string = lambda s: ''.join(reversed(s))
-    >>> tuple(sorted_items(sample, key=reverse_string))
-    (('foo', 20), ('bar', 42), ('baz', 10))
-
-    >>> tuple(sorted_items(sample, reverse=True))
-    (('foo', 20), ('baz', 10), ('bar', 42))
+    Pack keys into an array if they're all ints or all floats,
+    otherwise into a tuple.
+
+    >>> _compact([1, 2])
+    array('q', [1, 2])
+    >>> _compact([1.5, 2.5])
+    array('d', [1.5, 2.5])
+    >>> _compact([1, 2.5])
+    (1, 2.5)
+    >>> _compact([2**64])
+    (18446744073709551616,)
     """
+    kinds = set(map(type, keys))
+    typecode = {int: 'q', float: 'd'}.get(kinds.pop()) if len(kinds) == 1 else None
+    if typecode is None:
+        return tuple(keys)
+    try:
+        return array.array(typecode, keys)
+    except OverflowError:
+        return tuple(keys)
 
-    # wrap the key func so it operates on the first element of each item
-    def pairkey_key(item):
-        return key(item[0])
-
-    return sorted(d.items(), key=pairkey_key, reverse=reverse)
 
+def _intern(values: Iterable) -> tuple[tuple, array.array]:
+    """
+    Return the distinct values and, for each of values, the index
+    of its equal among them. Unhashable values are never shared.
 
-class KeyTransformingDict(dict):
+    >>> _intern(['a', 'b', 'a', 1, True, []])
+    (('a', 'b', 1, True, []), array('B', [0, 1, 0, 2, 3, 4]))
     """
-    A dict subclass that transforms the keys before they're used.
-    Subclasses may override the default transform_key to customize behavior.
+    distinct: list = []
+    positions: dict = {}
+    indexes = []
+    for value in values:
+        try:
+            # include the type so that equal values of different types
+            # (e.g. 1 and True) aren't conflated.
+            index = positions.setdefault((type(value), value), len(distinct))
+        except TypeError:
+            index = len(distinct)
+        if index == len(distinct):
+            distinct.append(value)
+        indexes.append(index)
+    typecode = next(
+        code for code in 'BHIL' if len(distinct) <= 1 << 8 * array.array(code).itemsize
+    )
+    return tuple(distinct), array.array(typecode, indexes)
+
+
+class FrozenRangeMap(collections.abc.Hashable):
     """
+    An immutable :class:`RangeMap`, compiled into a compact form.
 
-    @staticmethod
-    def transform_key(key):  # pragma: nocover
-        return key
+    Rather than a dict, the boundaries are held in sort order in a
+    packed array (if they're all ints or all floats) beside an array
+    of indexes into a table of the distinct values. Lookups use a
+    binary search over the boundaries where the comparator allows.
 
-    def __init__(self, *args, **kargs):
-        super().__init__()
-        # build a dictionary using the default constructs
-        d = dict(*args, **kargs)
-        # build this dictionary using transformed keys.
-        for item in d.items():
-            self.__setitem__(*item)
+    >>> r = FrozenRangeMap({0: RangeMap.undefined_value, 3: 'a', 6: 'b', 9: 'a'})
+    >>> r[1], r[3], r[4], r[7], r[9]
+    ('a', 'a', 'b', 'a', 'a')
+    >>> r[0]
+    Traceback (most recent call last):
+    ...
+    KeyError: 0
+    >>> r.get(10, 'not found')
+    'not found'
+    >>> r.bounds()
+    (0, 9)
+    >>> r[RangeMap.last_item]
+    'a'
+    >>> len(r), list(r)
+    (4, [0, 3, 6, 9])
 
-    def __setitem__(self, key, val):
-        key = self.transform_key(key)
-        super().__setitem__(key, val)
+    Compile an existing RangeMap (retaining its sort params and
+    comparator) with ``from_range_map``.
 
-    def __getitem__(self, key):
-        key = self.transform_key(key)
-        return super().__getitem__(key)
+    >>> left = FrozenRangeMap.from_range_map(RangeMap.left({1: 'a', 4: 'b'}))
+    >>> left[1], left[3], left[4], left[100]
+    ('a', 'a', 'b', 'b')
+    >>> left == FrozenRangeMap.left({1: 'a', 4: 'b'})
+    True
 
-    def __contains__(self, key):
-        key = self.transform_key(key)
-        return super().__contains__(key)
+    Like :class:`FrozenDict`, it's immutable and hashable.
+
+    >>> r[12] = 'c'
+    Traceback (most recent call last):
+    ...
+    TypeError: 'FrozenRangeMap' object does not support item assignment
+    >>> hash(left) == hash(FrozenRangeMap.left({4: 'b', 1: 'a'}))
+    True
+    """
+
+    __slots__ = [
+        '_bisector',
+        '_indexes',
+        '_keys',
+        '_mmap',
+        '_values',
+        'match',
+        'sort_params',
+    ]
+
+    _keys: Sequence
+    _indexes: Sequence[int]
+    _values: Sequence
+    _bisector: Callable[[Sequence, Any], int] | None
+    _mmap: mmap.mmap | None
+    sort_params: Mapping[str, Any]
+    match: Callable
+
+    def __new__(
+        cls,
+        source: (SupportsKeysAndGetItem[Any, Any] | Iterable[tuple[Any, Any]]),
+        sort_params: Mapping[str, Any] = {},
+        key_match_comparator: Callable[[Any, Any], bool] = operator.le,
+    ):
+        items = dict(source)
+        keys = sorted(items, **sort_params)
+        values, indexes = _intern(map(items.__getitem__, keys))
+        return cls._from_columns(
+            _compact(keys), indexes, values, sort_params, key_match_comparator
+        )
+
+    @classmethod
+    def _from_columns(
+        cls,
+        keys: Sequence,
+        indexes: Sequence[int],
+        values: Sequence,
+        sort_params: Mapping[str, Any],
+        match: Callable,
+    ) -> Self:
+        self = super().__new__(cls)
+        self._keys = keys
+        self._indexes = indexes
+        self._values = values
+        self.sort_params = sort_params
+        self.match = match
+        self._bisector = _range_bisector(match, sort_params)
+        self._mmap = None
+        return self
+
+    @classmethod
+    def left(
+        cls,
+        source: (SupportsKeysAndGetItem[Any, Any] | Iterable[tuple[Any, Any]]),
+    ) -> Self:
+        return cls(
+            source, sort_params=dict(reverse=True), key_match_comparator=operator.ge
+        )
+
+    @classmethod
+    def from_range_map(cls, range_map: RangeMap) -> Self:
+        return cls(range_map, range_map.sort_params, range_map.match)
+
+    def _locate(self, item) -> int:
+        if self._bisector is not None:
+            return self._bisector(self._keys, item)
+        is_match = functools.partial(self.match, item)
+        matches = (index for index, key in enumerate(self._keys) if is_match(key))
+        return next(matches, len(self._keys))
+
+    def __getitem__(self, item):
+        if isinstance(item, RangeMap.Item):
+            return self[self._keys[item]]
+        index = self._locate(item)
+        key = RangeMap._key_at_(self._keys, index, item)
+        result = self._values[self._indexes[index]]
+        if result is RangeMap.undefined_value:
+            raise KeyError(key)
+        return result
+
+    def get(self, key, default=None):
+        """
+        Return the value for key if key is in the range, else default.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def bounds(self) -> tuple[Any, Any]:
+        return (self._keys[RangeMap.first_item], self._keys[RangeMap.last_item])
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._keys)
+
+    def items(self) -> Iterator[tuple[Any, Any]]:
+        """
+        Generate the boundaries and their values in sort order.
+        """
+        return zip(self._keys, map(self._values.__getitem__, self._indexes))
+
+    def __hash__(self) -> int:
+        return hash(tuple(self.items()))
+
+    def __reduce__(self):
+        # the columns may be views of a file and the bisector is derived
+        args = list(self.items()), dict(self.sort_params), self.match
+        return type(self), args
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenRangeMap):
+            return NotImplemented
+        return (
+            list(self.items()) == list(other.items())
+            and self.sort_params == other.sort_params
+            and self.match == other.match
+        )
+
+    def save(self, path: StrPath) -> None:
+        """
+        Write the map to path, in a form suitable for :meth:`open`.
+
+        Only maps with int, float, or bytes keys, and using the stock
+        comparators and sort order, may be saved.
+        """
+        if self._bisector is None:
+            raise ValueError("Only maps with stock comparators may be saved")
+        keys = self._keys
+        if isinstance(keys, array.array):
+            kind = keys.typecode.encode()
+            key_block = _little_endian(keys).tobytes()
+        elif all(isinstance(key, bytes) for key in keys):
+            kind = b'b'
+            offsets = array.array('q', itertools.accumulate(map(len, keys), initial=0))
+            key_block = _little_endian(offsets).tobytes() + b''.join(keys)
+        else:
+            raise TypeError("Only int, float, or bytes keys may be saved")
+        indexes = _little_endian(array.array('I', self._indexes)).tobytes()
+        # note the position of the undefined value rather than pickling it
+        values = list(self._values)
+        undefined = next(
+            (
+                index
+                for index, value in enumerate(values)
+                if value is RangeMap.undefined_value
+            ),
+            None,
+        )
+        if undefined is not None:
+            values[undefined] = None
+        value_block = pickle.dumps((values, undefined))
+        header = _file_header.pack(
+            _file_magic,
+            _file_version,
+            kind,
+            _stock_comparators.index(self.match),
+            bool(self.sort_params.get('reverse')),
+            len(keys),
+            len(key_block),
+            len(value_block),
+        )
+        with open(path, 'wb') as file:
+            for block in header, key_block, indexes, value_block:
+                file.write(block)
+                file.write(bytes(_padding(len(block))))
+
+    @classmethod
+    def open(cls, path: StrPath) -> Self:
+        """
+        Open a map saved by :meth:`save`.
+
+        The file is memory-mapped, so the keys are searched in place
+        (sharing the OS page cache between processes) rather than read.
+        The values are unpickled, so only open trusted files.
+
+        The mapping is held until :meth:`close` (or the end of a
+        ``with`` block using the map).
+        """
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            header = _file_header.unpack_from(view)
+            if header[0] != _file_magic:
+                raise ValueError(f"{path} is not a saved range map")
+            if header[1] != _file_version:
+                raise ValueError(f"Unsupported range map format version {header[1]}")
+        except (ValueError, struct.error):
+            view.release()
+            mapped.close()
+            raise
+        _, _, kind, comparator, reverse, count, keys_size, values_size = header
+        offset = _file_header.size + _padding(_file_header.size)
+        key_view = view[offset : offset + keys_size]
+        keys: Sequence
+        if kind == b'b':
+            bound = 8 * (count + 1)
+            keys = _BytesColumn(_column(key_view[:bound], 'q'), key_view[bound:])
+        else:
+            keys = _column(key_view, kind.decode())
+        offset += keys_size + _padding(keys_size)
+        indexes = _column(view[offset : offset + 4 * count], 'I')
+        offset += 4 * count + _padding(4 * count)
+        values, undefined = pickle.loads(view[offset : offset + values_size])
+        if undefined is not None:
+            values[undefined] = RangeMap.undefined_value
+        sort_params = dict(reverse=True) if reverse else {}
+        match = _stock_comparators[comparator]
+        view.release()
+        self = cls._from_columns(keys, indexes, tuple(values), sort_params, match)
+        self._mmap = mapped
+        return self
+
+    def close(self) -> None:
+        """
+        Release the file mapped by :meth:`open`, after which the map
+        may no longer be used. Maps not opened from a file are
+        unaffected.
+        """
+        if self._mmap is None:
+            return
+        _release(self._keys)
+        _release(self._indexes)
+        self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# the format of files written by FrozenRangeMap.save: a header followed
+# by the keys, the value indexes, and the pickled values, each padded
+# to a multiple of eight bytes, with numbers little-endian.
+_file_magic = b'JCRM'
+_file_version = 1
+_file_header = struct.Struct('<4sHcBB7xQQQ')
+_stock_comparators = (operator.le, operator.lt, operator.ge, operator.gt)
+
+
+def _padding(size: int) -> int:
+    return -size % 8
+
+
+def _little_endian(column: array.array) -> array.array:
+    if sys.byteorder == 'big':  # pragma: nocover
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _column(view: memoryview, typecode: str) -> Sequence:
+    """
+    Present the little-endian numbers in view as a sequence, in place
+    where the platform allows.
+    """
+    if sys.byteorder == 'big':  # pragma: nocover
+        column = array.array(typecode, view)
+        column.byteswap()
+        return column
+    return view.cast(typecode)  # type: ignore[call-overload]
+
+
+def _release(column: Sequence) -> None:
+    """
+    Release the views of a file in column (from :func:`_column`).
+    """
+    if isinstance(column, _BytesColumn):
+        _release(column._offsets)
+        _release(column._blob)
+    elif isinstance(column, memoryview):
+        column.release()
+
+
+class _BytesColumn(collections.abc.Sequence):
+    """
+    Saved bytes keys, as a buffer of the keys concatenated
+    and the offsets at which each begins (and the last ends).
+    """
+
+    def __init__(self, offsets: Sequence[int], blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        return bytes(self._blob[self._offsets[index] : self._offsets[index + 1]])
+
+
+class _IntervalNode:
+    """
+    A node in the treap underlying :class:`IntervalMap`, ordered by
+    interval and augmented with the greatest upper bound and the
+    number of nodes in its subtree.
+    """
+
+    __slots__ = ('key', 'left', 'max_hi', 'priority', 'right', 'size', 'value')
+
+    def __init__(self, key: tuple[Any, Any], value: Any):
+        self.key = key
+        self.value = value
+        self.priority = random.random()
+        self.left: _IntervalNode | None = None
+        self.right: _IntervalNode | None = None
+        self.update()
+
+    def update(self) -> _IntervalNode:
+        self.max_hi = self.key[1]
+        self.size = 1
+        for child in self.left, self.right:
+            if child is not None:
+                self.max_hi = max(self.max_hi, child.max_hi)
+                self.size += child.size
+        return self
+
+
+_OptionalNode = Union[_IntervalNode, None]
+
+
+def _split(node: _OptionalNode, key) -> tuple[_OptionalNode, _OptionalNode]:
+    """
+    Split the treap at node into those keys less than key
+    and those not.
+    """
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        return node.update(), right
+    left, node.left = _split(node.left, key)
+    return left, node.update()
+
+
+def _merge(left: _OptionalNode, right: _OptionalNode) -> _OptionalNode:
+    """
+    Join two treaps, all of whose keys in left precede those in right.
+    """
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return left.update()
+    right.left = _merge(left, right.left)
+    return right.update()
+
+
+def _remove(node: _OptionalNode, key) -> _OptionalNode:
+    if node is None:
+        raise KeyError(key)
+    if key < node.key:
+        node.left = _remove(node.left, key)
+    elif node.key < key:
+        node.right = _remove(node.right, key)
+    else:
+        return _merge(node.left, node.right)
+    return node.update()
+
+
+def _stabbing(node: _OptionalNode, point) -> Iterator[_IntervalNode]:
+    """
+    Generate, in order, the nodes whose intervals contain point.
+    """
+    if node is None or not point < node.max_hi:
+        return
+    yield from _stabbing(node.left, point)
+    if node.key[0] <= point:
+        if point < node.key[1]:
+            yield node
+        yield from _stabbing(node.right, point)
+
+
+def _overlapping(node: _OptionalNode, lo, hi) -> Iterator[_IntervalNode]:
+    """
+    Generate, in order, the nodes whose intervals overlap [lo, hi).
+    """
+    if node is None or not lo < node.max_hi:
+        return
+    yield from _overlapping(node.left, lo, hi)
+    if node.key[0] < hi:
+        if lo < node.key[1]:
+            yield node
+        yield from _overlapping(node.right, lo, hi)
+
+
+class IntervalMap:
+    """
+    A mapping of half-open intervals ``[lo, hi)`` to values. Unlike
+    :class:`RangeMap`, the intervals are explicit, so they may leave
+    gaps between them and may overlap one another.
+
+    Construct from a mapping (or pairs) of ``(lo, hi)`` to values and
+    assign further intervals by slice.
+
+    >>> schedule = IntervalMap({(9, 12): 'standup', (10, 11): 'review'})
+    >>> schedule[13:17] = 'focus'
+
+    Looking up a point supplies the value of the first interval (by
+    start, then end) containing that point.
+
+    >>> schedule[10], schedule[11.5], schedule[16]
+    ('standup', 'standup', 'focus')
+    >>> schedule[12]
+    Traceback (most recent call last):
+    ...
+    KeyError: 12
+    >>> schedule.get(12, 'free')
+    'free'
+
+    ``stab`` generates every interval containing a point, and
+    ``overlap`` every interval overlapping a span, each as
+    ``(lo, hi, value)`` in order.
+
+    >>> list(schedule.stab(10))
+    [(9, 12, 'standup'), (10, 11, 'review')]
+    >>> list(schedule.overlap(11, 14))
+    [(9, 12, 'standup'), (13, 17, 'focus')]
+
+    Slices address the intervals themselves.
+
+    >>> schedule[10:11]
+    'review'
+    >>> del schedule[10:11]
+    >>> list(schedule.stab(10))
+    [(9, 12, 'standup')]
+    >>> schedule[9:12] = 'retro'
+    >>> schedule
+    IntervalMap({(9, 12): 'retro', (13, 17): 'focus'})
+    >>> schedule[12:12] = 'nothing'
+    Traceback (most recent call last):
+    ...
+    ValueError: Interval must not be empty
+
+    As with RangeMap, one can find the bounds or get the first or
+    last elements using RangeMap.Item.
+
+    >>> schedule.bounds()
+    (9, 17)
+    >>> schedule[IntervalMap.last_item]
+    'focus'
+    >>> len(schedule), list(schedule)
+    (2, [(9, 12), (13, 17)])
+
+    The intervals are kept in a treap (a randomized balanced search
+    tree) augmented with the greatest upper bound of each subtree, so
+    assignment and deletion take O(log n) and queries take O(log n)
+    plus the number of intervals found.
+    """
+
+    Item = RangeMap.Item
+    first_item = RangeMap.first_item
+    last_item = RangeMap.last_item
+
+    def __init__(
+        self,
+        source: (
+            SupportsKeysAndGetItem[tuple[Any, Any], Any]
+            | Iterable[tuple[tuple[Any, Any], Any]]
+        ) = (),
+    ):
+        self._root: _OptionalNode = None
+        for (lo, hi), value in dict(source).items():
+            self[lo:hi] = value
+
+    @staticmethod
+    def _interval(key: slice) -> tuple[Any, Any]:
+        if key.step is not None:
+            raise ValueError("Intervals do not support a step")
+        if not key.start < key.stop:
+            raise ValueError("Interval must not be empty")
+        return key.start, key.stop
+
+    def _find(self, key: tuple[Any, Any]) -> _IntervalNode:
+        node = self._root
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            elif node.key < key:
+                node = node.right
+            else:
+                return node
+        raise KeyError(key)
+
+    def _select(self, index: int) -> _IntervalNode:
+        """
+        Return the node at index in the order of intervals.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("interval index out of range")
+        node = self._root
+        while node is not None:
+            left_size = node.left.size if node.left is not None else 0
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node
+            else:
+                index -= left_size + 1
+                node = node.right
+        raise AssertionError("unreachable")  # pragma: nocover
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._find(self._interval(key)).value
+        if isinstance(key, RangeMap.Item):
+            return self._select(key).value
+        for node in _stabbing(self._root, key):
+            return node.value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        """
+        Return the value for key if any interval contains it, else default.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: slice, value) -> None:
+        interval = self._interval(key)
+        try:
+            self._find(interval).value = value
+        except KeyError:
+            left, right = _split(self._root, interval)
+            self._root = _merge(_merge(left, _IntervalNode(interval, value)), right)
+
+    def __delitem__(self, key: slice) -> None:
+        self._root = _remove(self._root, self._interval(key))
+
+    def __len__(self) -> int:
+        return self._root.size if self._root is not None else 0
+
+    def _nodes(self) -> Iterator[_IntervalNode]:
+        stack: list[_IntervalNode] = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
+    def __iter__(self) -> Iterator[tuple[Any, Any]]:
+        return (node.key for node in self._nodes())
+
+    def items(self) -> Iterator[tuple[tuple[Any, Any], Any]]:
+        return ((node.key, node.value) for node in self._nodes())
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+    def stab(self, point) -> Iterator[tuple[Any, Any, Any]]:
+        """
+        Generate ``(lo, hi, value)`` for each interval containing point.
+        """
+        return ((*node.key, node.value) for node in _stabbing(self._root, point))
+
+    def overlap(self, lo, hi) -> Iterator[tuple[Any, Any, Any]]:
+        """
+        Generate ``(lo, hi, value)`` for each interval overlapping
+        ``[lo, hi)``.
+        """
+        nodes = _overlapping(self._root, lo, hi)
+        return ((*node.key, node.value) for node in nodes)
+
+    def bounds(self) -> tuple[Any, Any]:
+        return self._select(0).key[0], self._root.max_hi  # type: ignore[union-attr]
+
+
+def __identity(x):
+    return x
+
+
+def sorted_items(d, key=__identity, reverse=False):
+    """
+    Return the items of the dictionary sorted by the keys.
+
+    >>> sample = dict(foo=20, bar=42, baz=10)
+    >>> tuple(sorted_items(sample))
+    (('bar', 42), ('baz', 10), ('foo', 20))
+
+    >>> reverse_string = lambda s: ''.join(reversed(s))
+    >>> tuple(sorted_items(sample, key=reverse_string))
+    (('foo', 20), ('bar', 42), ('baz', 10))
+
+    >>> tuple(sorted_items(sample, reverse=True))
+    (('foo', 20), ('baz', 10), ('bar', 42))
+    """
+
+    # wrap the key func so it operates on the first element of each item
+    def pairkey_key(item):
+        return key(item[0])
+
+    return sorted(d.items(), key=pairkey_key, reverse=reverse)
+
+
+def _dict_items(*args, **kwargs):
+    """
+    Generate the items from a mapping or iterable of pairs and
+    keyword arguments, as accepted by ``dict()``, without building
+    a dict.
+
+    >>> list(_dict_items({'a': 1}, b=2))
+    [('a', 1), ('b', 2)]
+    >>> list(_dict_items([('a', 1)]))
+    [('a', 1)]
+    """
+    if len(args) > 1:
+        raise TypeError(f'expected at most 1 argument, got {len(args)}')
+    for source in args:
+        if isinstance(source, dict):
+            yield from source.items()
+        elif hasattr(source, 'keys'):
+            yield from ((key, source[key]) for key in source.keys())
+        else:
+            yield from source
+    yield from kwargs.items()
+
+
+class KeyTransformingDict(dict):
+    """
+    A dict subclass that transforms the keys before they're used.
+    Subclasses may override the default transform_key to customize behavior.
+
+    The keys as originally supplied are indexed by their transformed
+    form, so the original for any key may be retrieved directly.
+
+    >>> d = KeyTransformingDict(a=1)
+    >>> d.update([('b', 2)], c=3)
+    >>> d.setdefault('d', 4)
+    4
+    >>> d.matching_key_for('d')
+    'd'
+    >>> d.pop('a')
+    1
+    >>> d.popitem()
+    ('d', 4)
+    >>> sorted(d._originals)
+    ['b', 'c']
+    >>> d.clear()
+    >>> d._originals
+    {}
+    """
+
+    _originals: dict
+
+    @staticmethod
+    def transform_key(key):  # pragma: nocover
+        return key
+
+    def __new__(cls, *args, **kwargs):
+        # initialized here so it's present before unpickling or copying
+        # restores the items
+        self = super().__new__(cls, *args, **kwargs)
+        self._originals = {}
+        return self
+
+    def __init__(self, *args, **kargs):
+        super().__init__()
+        self._update(_dict_items(*args, **kargs))
+
+    def _update(self, items):
+        """
+        Add the (key, value) items in one pass, transforming the keys.
+        """
+        transform = self.transform_key
+        setitem = super().__setitem__
+        setdefault = self._originals.setdefault
+        for key, value in items:
+            transformed = transform(key)
+            setitem(transformed, value)
+            setdefault(transformed, key)
+
+    def __setitem__(self, key, val):
+        transformed = self.transform_key(key)
+        super().__setitem__(transformed, val)
+        self._originals.setdefault(transformed, key)
+
+    def __getitem__(self, key):
+        key = self.transform_key(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        key = self.transform_key(key)
+        return super().__contains__(key)
 
     def __delitem__(self, key):
         key = self.transform_key(key)
-        return super().__delitem__(key)
+        super().__delitem__(key)
+        del self._originals[key]
 
     def get(self, key, *args, **kwargs):
         key = self.transform_key(key)
         return super().get(key, *args, **kwargs)
 
     def setdefault(self, key, *args, **kwargs):
-        key = self.transform_key(key)
-        return super().setdefault(key, *args, **kwargs)
+        transformed = self.transform_key(key)
+        self._originals.setdefault(transformed, key)
+        return super().setdefault(transformed, *args, **kwargs)
 
     def pop(self, key, *args, **kwargs):
         key = self.transform_key(key)
+        self._originals.pop(key, None)
         return super().pop(key, *args, **kwargs)
 
-    def matching_key_for(self, key):
+    def popitem(self):
+        key, value = super().popitem()
+        del self._originals[key]
+        return key, value
+
+    def update(self, *args, **kwargs):
+        self._update(_dict_items(*args, **kwargs))
+
+    def __ior__(self, other):
+        self._update(_dict_items(other))
+        return self
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        result = self.copy()
+        result._update(_dict_items(other))
+        return result
+
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        result = cls()
+        result._update((key, value) for key in iterable)
+        return result
+
+    def copy(self):
+        """
+        Return a shallow copy of the same type, without transforming
+        the keys again.
+
+        >>> d = FoldedCaseKeyedDict(Key='value')
+        >>> clone = d.copy()
+        >>> clone
+        {'Key': 'value'}
+        >>> type(clone).__name__
+        'FoldedCaseKeyedDict'
+        >>> clone.matching_key_for('KEY')
+        'Key'
+        """
+        result = type(self).__new__(type(self))
+        vars(result).update(vars(self), _originals=self._originals.copy())
+        dict.update(result, dict.items(self))
+        return result
+
+    def clear(self):
+        super().clear()
+        self._originals.clear()
+
+    def matching_key_for(self, key):
+        """
+        Given a key, return the matching key in the form in which
+        it was originally supplied.
+        Raise KeyError if the key isn't found.
+        """
+        try:
+            return self._originals[self.transform_key(key)]
+        except KeyError:
+            raise KeyError(key) from None
+
+
+class FoldedCaseKeyedDict(KeyTransformingDict):
+    """
+    A case-insensitive dictionary (keys are compared as insensitive
+    if they are strings).
+
+    >>> d = FoldedCaseKeyedDict()
+    >>> d['heLlo'] = 'world'
+    >>> list(d.keys()) == ['heLlo']
+    True
+    >>> list(d.values()) == ['world']
+    True
+    >>> d['hello'] == 'world'
+    True
+    >>> 'hello' in d
+    True
+    >>> 'HELLO' in d
+    True
+    >>> print(repr(FoldedCaseKeyedDict({'heLlo': 'world'})))
+    {'heLlo': 'world'}
+    >>> d = FoldedCaseKeyedDict({'heLlo': 'world'})
+    >>> print(d['hello'])
+    world
+    >>> print(d['Hello'])
+    world
+    >>> list(d.keys())
+    ['heLlo']
+    >>> d = FoldedCaseKeyedDict({'heLlo': 'world', 'Hello': 'world'})
+    >>> list(d.values())
+    ['world']
+    >>> key, = d.keys()
+    >>> key in ['heLlo', 'Hello']
+    True
+    >>> del d['HELLO']
+    >>> d
+    {}
+
+    get should work
+
+    >>> d['Sumthin'] = 'else'
+    >>> d.get('SUMTHIN')
+    'else'
+    >>> d.get('OTHER', 'thing')
+    'thing'
+    >>> del d['sumthin']
+
+    setdefault should also work
+
+    >>> d['This'] = 'that'
+    >>> print(d.setdefault('this', 'other'))
+    that
+    >>> len(d)
+    1
+    >>> print(d['this'])
+    that
+    >>> print(d.setdefault('That', 'other'))
+    other
+    >>> print(d['THAT'])
+    other
+
+    Make it pop!
+
+    >>> print(d.pop('THAT'))
+    other
+
+    To retrieve the key in its originally-supplied form, use matching_key_for
+
+    >>> print(d.matching_key_for('this'))
+    This
+
+    >>> d.matching_key_for('missing')
+    Traceback (most recent call last):
+    ...
+    KeyError: 'missing'
+    """
+
+    @staticmethod
+    def transform_key(key):
+        return jaraco.text.FoldedCase(key)
+
+    def matching_key_for(self, key):
+        """
+        Given a key, return the matching key stored in self, a
+        FoldedCase of the key in the form in which it was
+        originally supplied.
+
+        >>> d = FoldedCaseKeyedDict(Accept='*/*')
+        >>> type(d.matching_key_for('ACCEPT')).__name__
+        'FoldedCase'
+        """
+        return self.transform_key(super().matching_key_for(key))
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _casefold(key) -> str:
+    return str(key).casefold()
+
+
+class CaseInsensitiveDict(FoldedCaseKeyedDict):
+    """
+    A case-insensitive dictionary storing its items under the plain
+    casefolded keys, with the keys as originally supplied presented
+    in their place.
+
+    Folding of recently-used keys is memoized, so lookups cost
+    about the same as on a plain dict.
+
+    >>> d = CaseInsensitiveDict({'Content-Type': 'text/plain'})
+    >>> d['content-type']
+    'text/plain'
+    >>> 'CONTENT-TYPE' in d
+    True
+    >>> d['CONTENT-type'] = 'text/html'
+    >>> d
+    {'Content-Type': 'text/html'}
+    >>> list(d)
+    ['Content-Type']
+    >>> d.keys()
+    KeysView({'Content-Type': 'text/html'})
+    >>> 'content-type' in d.keys()
+    True
+    >>> list(d.items())
+    [('Content-Type', 'text/html')]
+    >>> d.matching_key_for('content-type')
+    'Content-Type'
+    >>> type(d.matching_key_for('content-type')).__name__
+    'str'
+    >>> d.popitem()
+    ('Content-Type', 'text/html')
+
+    Keys that aren't strings are folded as their string form, as
+    with FoldedCaseKeyedDict.
+
+    >>> d[3] = 'three'
+    >>> d['3']
+    'three'
+    """
+
+    @staticmethod
+    def transform_key(key):
+        try:
+            return _casefold(key)
+        except TypeError:  # unhashable
+            return str(key).casefold()
+
+    matching_key_for = KeyTransformingDict.matching_key_for
+
+    def __iter__(self):
+        return iter(self._originals.values())
+
+    def keys(self):
+        return collections.abc.KeysView(self)
+
+    def items(self):
+        return collections.abc.ItemsView(self)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return self._originals.pop(key), value
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+# marks the entries of a CaseInsensitiveMultiDict that have been removed
+_vacant = object()
+
+
+class _MultiItemsView(collections.abc.ItemsView):
+    def __len__(self):
+        return self._mapping._size()
+
+    def __iter__(self):
+        return self._mapping._entries()
+
+    def __contains__(self, item):
+        key, value = item
+        return value in self._mapping.getall(key)
+
+
+class _MultiValuesView(collections.abc.ValuesView):
+    def __len__(self):
+        return self._mapping._size()
+
+    def __iter__(self):
+        return (value for key, value in self._mapping._entries())
+
+    def __contains__(self, value):
+        return any(value is each or value == each for each in self)
+
+
+class CaseInsensitiveMultiDict(collections.abc.MutableMapping):
+    """
+    A case-insensitive mapping of keys to one or more values, kept
+    in the order in which they were added, as for the headers of a
+    message.
+
+    >>> headers = CaseInsensitiveMultiDict(
+    ...     [('Set-Cookie', 'a=1'), ('Host', 'example.com')])
+    >>> headers.add('set-cookie', 'b=2')
+    >>> headers['SET-COOKIE']
+    'a=1'
+    >>> headers.getall('set-cookie')
+    ['a=1', 'b=2']
+    >>> len(headers)
+    2
+    >>> list(headers)
+    ['Set-Cookie', 'Host']
+
+    The items and values include every entry.
+
+    >>> list(headers.items())
+    [('Set-Cookie', 'a=1'), ('Host', 'example.com'), ('set-cookie', 'b=2')]
+    >>> len(headers.values())
+    3
+
+    Assigning to a key replaces all of its values.
+
+    >>> headers['Host'] = 'example.org'
+    >>> headers.popall('Set-Cookie')
+    ['a=1', 'b=2']
+    >>> headers
+    CaseInsensitiveMultiDict([('Host', 'example.org')])
+    >>> headers.popall('Set-Cookie', [])
+    []
+
+    Entries are stored in flat lists, each linked to the next entry
+    for the same key, with the first and last entries for each key
+    indexed by the transformed key, so the first value is found
+    directly. Removed entries are left vacant until they outnumber
+    the rest.
+    """
+
+    transform_key = staticmethod(CaseInsensitiveDict.transform_key)
+
+    _keys: list
+    _values: list
+    # the position of the next entry for the same key, or -1
+    _links: list[int]
+    # the positions of the first and last entries for each key
+    _heads: dict
+    _tails: dict
+
+    def __init__(self, *args, **kwargs):
+        self.clear()
+        self.extend(*args, **kwargs)
+
+    def clear(self):
+        self._keys = []
+        self._values = []
+        self._links = []
+        self._heads = {}
+        self._tails = {}
+        self._vacancies = 0
+
+    def add(self, key, value):
+        """
+        Add a value for the key, after any others.
+        """
+        transformed = self.transform_key(key)
+        position = len(self._keys)
+        self._keys.append(key)
+        self._values.append(value)
+        self._links.append(-1)
+        tail = self._tails.get(transformed)
+        if tail is None:
+            self._heads[transformed] = position
+        else:
+            self._links[tail] = position
+        self._tails[transformed] = position
+
+    def extend(self, *args, **kwargs):
+        """
+        Add each of the items, as accepted by ``dict()``, including
+        repeated keys.
+        """
+        if args and isinstance(args[0], CaseInsensitiveMultiDict):
+            args = (args[0].items(),) + args[1:]
+        for key, value in _dict_items(*args, **kwargs):
+            self.add(key, value)
+
+    def _positions(self, position):
+        while position != -1:
+            yield position
+            position = self._links[position]
+
+    def _entries(self):
+        return (
+            (key, value)
+            for key, value in zip(self._keys, self._values)
+            if key is not _vacant
+        )
+
+    def _size(self):
+        return len(self._keys) - self._vacancies
+
+    def _vacate(self, head):
+        """
+        Remove the entries linked from head, returning their values.
+        """
+        values = []
+        for position in self._positions(head):
+            values.append(self._values[position])
+            self._keys[position] = self._values[position] = _vacant
+        self._vacancies += len(values)
+        if self._vacancies > len(self._keys) // 2:
+            entries = list(self._entries())
+            self.clear()
+            self.extend(entries)
+        return values
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._heads[self.transform_key(key)]]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return self.transform_key(key) in self._heads
+
+    def getall(self, key):
+        """
+        Return all of the values for the key, or an empty list.
+        """
+        head = self._heads.get(self.transform_key(key), -1)
+        return [self._values[position] for position in self._positions(head)]
+
+    def popall(self, key, *default):
         """
-        Given a key, return the actual key stored in self that matches.
-        Raise KeyError if the key isn't found.
+        Remove the key, returning all of its values, or the default if
+        supplied and the key isn't found.
         """
+        transformed = self.transform_key(key)
         try:
-            return next(e_key for e_key in self.keys() if e_key == key)
-        except StopIteration as err:
-            raise KeyError(key) from err
-
-
-class FoldedCaseKeyedDict(KeyTransformingDict):
-    """
-    A case-insensitive dictionary (keys are compared as insensitive
-    if they are strings).
+            head = self._heads.pop(transformed)
+        except KeyError:
+            if default:
+                return default[0]
+            raise KeyError(key) from None
+        del self._tails[transformed]
+        return self._vacate(head)
+
+    def __setitem__(self, key, value):
+        transformed = self.transform_key(key)
+        head = self._heads.get(transformed)
+        if head is None:
+            self.add(key, value)
+            return
+        self._values[head] = value
+        rest, self._links[head] = self._links[head], -1
+        self._tails[transformed] = head
+        self._vacate(rest)
 
-    >>> d = FoldedCaseKeyedDict()
-    >>> d['heLlo'] = 'world'
-    >>> list(d.keys()) == ['heLlo']
-    True
-    >>> list(d.values()) == ['world']
-    True
-    >>> d['hello'] == 'world'
-    True
-    >>> 'hello' in d
-    True
-    >>> 'HELLO' in d
-    True
-    >>> print(repr(FoldedCaseKeyedDict({'heLlo': 'world'})))
-    {'heLlo': 'world'}
-    >>> d = FoldedCaseKeyedDict({'heLlo': 'world'})
-    >>> print(d['hello'])
-    world
-    >>> print(d['Hello'])
-    world
-    >>> list(d.keys())
-    ['heLlo']
-    >>> d = FoldedCaseKeyedDict({'heLlo': 'world', 'Hello': 'world'})
-    >>> list(d.values())
-    ['world']
-    >>> key, = d.keys()
-    >>> key in ['heLlo', 'Hello']
-    True
-    >>> del d['HELLO']
-    >>> d
-    {}
+    def __delitem__(self, key):
+        self.popall(key)
 
-    get should work
+    def __iter__(self):
+        return (self._keys[position] for position in self._heads.values())
 
-    >>> d['Sumthin'] = 'else'
-    >>> d.get('SUMTHIN')
-    'else'
-    >>> d.get('OTHER', 'thing')
-    'thing'
-    >>> del d['sumthin']
+    def __len__(self):
+        return len(self._heads)
 
-    setdefault should also work
+    def items(self):
+        return _MultiItemsView(self)
 
-    >>> d['This'] = 'that'
-    >>> print(d.setdefault('this', 'other'))
-    that
-    >>> len(d)
-    1
-    >>> print(d['this'])
-    that
-    >>> print(d.setdefault('That', 'other'))
-    other
-    >>> print(d['THAT'])
-    other
+    def values(self):
+        return _MultiValuesView(self)
 
-    Make it pop!
+    def matching_key_for(self, key):
+        """
+        Given a key, return the matching key in the form in which
+        it was first supplied.
+        Raise KeyError if the key isn't found.
+        """
+        try:
+            return self._keys[self._heads[self.transform_key(key)]]
+        except KeyError:
+            raise KeyError(key) from None
 
-    >>> print(d.pop('THAT'))
-    other
+    def _folded(self):
+        return [(self.transform_key(key), value) for key, value in self._entries()]
 
-    To retrieve the key in its originally-supplied form, use matching_key_for
+    def __eq__(self, other):
+        if not isinstance(other, CaseInsensitiveMultiDict):
+            return super().__eq__(other)
+        return self._folded() == other._folded()
 
-    >>> print(d.matching_key_for('this'))
-    This
+    def __reduce__(self):
+        return type(self), (list(self._entries()),)
 
-    >>> d.matching_key_for('missing')
-    Traceback (most recent call last):
-    ...
-    KeyError: 'missing'
-    """
+    def copy(self):
+        return type(self)(self)
 
-    @staticmethod
-    def transform_key(key):
-        return jaraco.text.FoldedCase(key)
+    def __repr__(self):
+        return f'{type(self).__name__}({list(self._entries())!r})'
 
 
 class DictAdapter:
@@ -581,10 +2585,23 @@ class IdentityOverrideMap(dict):
         return key
 
 
+def _invalidating(method: Callable) -> Callable:
+    """
+    Wrap the method of a list to discard the index of a DictStack.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class DictStack(list, collections.abc.MutableMapping):
     """
-    A stack of dictionaries that behaves as a view on those dictionaries,
-    giving preference to the last.
+    A stack of dictionaries, looking up each key in the last
+    holding it.
 
     >>> stack = DictStack([dict(a=1, c=2), dict(b=2, a=2)])
     >>> stack['a']
@@ -617,37 +2634,301 @@ class DictStack(list, collections.abc.MutableMapping):
     >>> del stack['c']
     >>> dict(stack)
     {'a': 1}
+
+    Keys are found through an index of the topmost scope holding
+    each, built on first use and kept current by the methods of the
+    stack. Unlike a view, the stack doesn't see keys added to or
+    removed from a scope directly, so change the scopes through the
+    stack. Keys are in a deterministic order, as first seen from
+    the bottom scope up when the index is built.
+
+    >>> stack = DictStack([dict(a=1, b=1), dict(c=2, a=2)])
+    >>> stack.push(dict(d=3))
+    >>> list(stack), len(stack)
+    (['a', 'b', 'c', 'd'], 4)
+    >>> stack.insert(0, dict(e=0))
+    >>> list(stack)
+    ['e', 'a', 'b', 'c', 'd']
+
+    Copies hold the same scopes, each with its own index.
+
+    >>> clone = copy.copy(stack)
+    >>> clone.push(dict(f=5))
+    >>> 'f' in stack, list.__len__(clone)
+    (False, 5)
     """
 
+    # key: position of the topmost scope holding it
+    _index: dict | None = None
+
+    def _indexed(self) -> dict:
+        if self._index is None:
+            index: dict = {}
+            for position, scope in enumerate(list.__iter__(self)):
+                index.update(dict.fromkeys(scope, position))
+            self._index = index
+        return self._index
+
+    def _reindex(self, index: dict, key, above: int):
+        """
+        Index the key at the topmost scope holding it below ``above``.
+        """
+        for position in range(above - 1, -1, -1):
+            if key in list.__getitem__(self, position):
+                index[key] = position
+                return
+        del index[key]
+
     def __iter__(self):
-        dicts = list.__iter__(self)
-        return iter(set(itertools.chain.from_iterable(c.keys() for c in dicts)))
+        return iter(self._indexed())
+
+    def __reduce__(self):
+        # the scopes, rather than the keys (as iterated), without the index
+        return type(self), (list(list.__iter__(self)),)
 
     def __getitem__(self, key):
-        for scope in reversed(tuple(list.__iter__(self))):
-            if key in scope:
-                return scope[key]
-        raise KeyError(key)
+        return list.__getitem__(self, self._indexed()[key])[key]
+
+    def push(self, scope):
+        if self._index is not None:
+            self._index.update(dict.fromkeys(scope, list.__len__(self)))
+        list.append(self, scope)
 
-    push = list.append
+    append = push
 
     def __contains__(self, other):
-        return collections.abc.Mapping.__contains__(self, other)
+        return other in self._indexed()
 
     def __len__(self):
-        return len(list(iter(self)))
+        return len(self._indexed())
 
     def __setitem__(self, key, item):
         last = list.__getitem__(self, -1)
-        return last.__setitem__(key, item)
+        last.__setitem__(key, item)
+        if self._index is not None:
+            self._index[key] = list.__len__(self) - 1
 
     def __delitem__(self, key):
         last = list.__getitem__(self, -1)
-        return last.__delitem__(key)
+        last.__delitem__(key)
+        if self._index is not None:
+            self._reindex(self._index, key, list.__len__(self) - 1)
 
     # workaround for mypy confusion
-    def pop(self, *args, **kwargs):
-        return list.pop(self, *args, **kwargs)
+    def pop(self, index=-1):
+        top = list.__len__(self) - 1
+        scope = list.pop(self, index)
+        if self._index is None:
+            pass
+        elif index in (-1, top):
+            for key in scope:
+                self._reindex(self._index, key, top)
+        else:
+            self._index = None
+        return scope
+
+    insert = _invalidating(list.insert)
+    extend = _invalidating(list.extend)
+    remove = _invalidating(list.remove)
+    clear = _invalidating(list.clear)
+    reverse = _invalidating(list.reverse)
+    sort = _invalidating(list.sort)
+    __iadd__ = _invalidating(list.__iadd__)
+    __imul__ = _invalidating(list.__imul__)
+
+
+class _Frame:
+    """
+    A scope of a PersistentDictStack over the frame beneath it,
+    shared by the stacks holding it. Lookups walk down the scopes
+    to the nearest frame whose items have been merged (on first
+    iteration), so pushing a scope copies nothing.
+    """
+
+    __slots__ = ('_merged', 'parent', 'scope')
+
+    def __init__(self, scope: Mapping, parent: _Frame | None):
+        self.scope = scope
+        self.parent = parent
+        self._merged: dict | None = None
+
+    def find(self, key) -> object:
+        """
+        Return the value for key in the nearest scope holding it,
+        or ``_vacant`` if none does.
+        """
+        frame: _Frame | None = self
+        while frame is not None:
+            if frame._merged is not None:
+                return frame._merged.get(key, _vacant)
+            if key in frame.scope:
+                return frame.scope[key]
+            frame = frame.parent
+        return _vacant
+
+    @property
+    def merged(self) -> dict:
+        if self._merged is None:
+            frames = []
+            frame: _Frame | None = self
+            while frame is not None and frame._merged is None:
+                frames.append(frame)
+                frame = frame.parent
+            merged = {} if frame is None else dict(frame.merged)
+            for frame in reversed(frames):
+                merged.update(frame.scope)
+            self._merged = merged
+        return self._merged
+
+
+class PersistentDictStack(collections.abc.MutableMapping):
+    """
+    A stack of dictionaries like :class:`DictStack` that may be forked
+    cheaply, the forks sharing the scopes and their merged items.
+    Writes go to the top scope of each stack, copied first if it's
+    shared with another.
+
+    >>> base = PersistentDictStack([dict(a=1, b=1), dict(b=2)])
+    >>> base['a'], base['b'], len(base)
+    (1, 2, 2)
+    >>> request = base.fork()
+    >>> request.push(dict(c=3))
+    >>> request['b'] = 4
+    >>> dict(request)
+    {'a': 1, 'b': 4, 'c': 3}
+    >>> other = base.fork()
+    >>> other['b'] = 5
+    >>> del other['b']
+    >>> dict(other), dict(base)
+    ({'a': 1, 'b': 1}, {'a': 1, 'b': 2})
+    >>> request.pop()
+    {'c': 3, 'b': 4}
+    >>> base
+    PersistentDictStack([{'a': 1, 'b': 1}, {'b': 2}])
+
+    As with DictStack, change the scopes through the stack rather
+    than directly.
+    """
+
+    _frame: _Frame | None
+    # whether the top scope belongs only to this stack
+    _owned: bool
+    # the number of keys in the top scope but not beneath it
+    _new: int | None
+
+    def __init__(self, scopes: Iterable[Mapping] = ()):
+        self._frame = None
+        self._owned = False
+        self._new = 0
+        for scope in scopes:
+            self.push(scope)
+
+    def fork(self) -> Self:
+        """
+        Return a stack of the same scopes, changing independently.
+        """
+        fork = object.__new__(type(self))
+        fork._frame = self._frame
+        fork._owned = self._owned = False
+        fork._new = self._new
+        return fork
+
+    def push(self, scope: Mapping) -> None:
+        self._frame = _Frame(scope, self._frame)
+        self._owned = True
+        self._new = None
+
+    def pop(self) -> Mapping:  # type: ignore[override]
+        """
+        Remove the top scope and return it (or a copy, if shared).
+        """
+        if self._frame is None:
+            raise IndexError('pop from empty stack')
+        scope = self._frame.scope if self._owned else dict(self._frame.scope)
+        self._frame = self._frame.parent
+        self._owned = False
+        self._new = None
+        return scope
+
+    def _beneath(self) -> dict:
+        if self._frame is None or self._frame.parent is None:
+            return {}
+        return self._frame.parent.merged
+
+    def _below(self, key) -> bool:
+        """
+        Whether key is in a scope beneath the top.
+        """
+        parent = self._frame and self._frame.parent
+        return parent is not None and parent.find(key) is not _vacant
+
+    def _top(self) -> dict:
+        """
+        Return the top scope, copied first if shared.
+        """
+        if self._frame is None:
+            raise IndexError('no scope in stack')
+        if not self._owned:
+            self._frame = _Frame(dict(self._frame.scope), self._frame.parent)
+            self._owned = True
+        return self._frame.scope  # type: ignore[return-value]
+
+    def __getitem__(self, key):
+        value = _vacant if self._frame is None else self._frame.find(key)
+        if value is _vacant:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._frame is not None and self._frame.find(key) is not _vacant
+
+    def __setitem__(self, key, value):
+        top = self._top()
+        if self._new is not None and key not in top and not self._below(key):
+            self._new += 1
+        top[key] = value
+
+    def __delitem__(self, key):
+        del self._top()[key]
+        if self._new is not None and not self._below(key):
+            self._new -= 1
+
+    def clear(self) -> None:
+        """
+        Remove the items of the top scope. Those of the scopes
+        beneath remain.
+        """
+        if self._frame is None:
+            return
+        if self._owned:
+            self._frame.scope.clear()  # type: ignore[attr-defined]
+        else:
+            self._frame = _Frame({}, self._frame.parent)
+            self._owned = True
+        self._new = 0
+
+    def __iter__(self):
+        if self._frame is None:
+            return iter(())
+        beneath = self._beneath()
+        new = (key for key in self._frame.scope if key not in beneath)
+        return itertools.chain(beneath, new)
+
+    def __len__(self):
+        if self._frame is None:
+            return 0
+        if self._new is None:
+            beneath = self._beneath()
+            self._new = sum(key not in beneath for key in self._frame.scope)
+        return len(self._beneath()) + self._new
+
+    def __repr__(self):
+        scopes = []
+        frame = self._frame
+        while frame is not None:
+            scopes.append(frame.scope)
+            frame = frame.parent
+        return f'{type(self).__name__}({scopes[::-1]!r})'
 
 
 class BijectiveMap(dict):
@@ -730,23 +3011,350 @@ class BijectiveMap(dict):
         super().__setitem__(item, value)
         super().__setitem__(value, item)
 
-    def __delitem__(self, item):
-        self.pop(item)
+    def __delitem__(self, item):
+        self.pop(item)
+
+    def __len__(self):
+        return super().__len__() // 2
+
+    def pop(self, key, *args, **kwargs):
+        mirror = self[key]
+        super().__delitem__(mirror)
+        return super().pop(key, *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        # build a dictionary using the default constructs
+        d = dict(*args, **kwargs)
+        # build this dictionary using transformed keys.
+        for item in d.items():
+            self.__setitem__(*item)
+
+
+class BidirectionalMap(collections.abc.MutableMapping):
+    """
+    A one-to-one mapping, keeping keys and values in separate
+    dicts, so they may share a domain, and viewing the inverse
+    mapping of values to keys without copying either.
+
+    >>> m = BidirectionalMap(a='b', b='c')
+    >>> m['b']
+    'c'
+    >>> m.inverse['b']
+    'a'
+    >>> m['c'] = 'd'
+    >>> m.inverse
+    BidirectionalMap({'b': 'a', 'c': 'b', 'd': 'c'})
+
+    Each value may be mapped from only one key.
+
+    >>> m['d'] = 'b'
+    Traceback (most recent call last):
+    ...
+    ValueError: Value 'b' is already mapped from 'a'
+
+    Changes through the inverse apply to both.
+
+    >>> m.inverse['e'] = 'f'
+    >>> del m.inverse['c']
+    >>> m
+    BidirectionalMap({'a': 'b', 'c': 'd', 'f': 'e'})
+
+    Updates check all of the items before applying any, so pairs
+    may be exchanged.
+
+    >>> m.update(a='e', f='b')
+    >>> m
+    BidirectionalMap({'a': 'e', 'c': 'd', 'f': 'b'})
+    >>> m.update(g='h', i='e')
+    Traceback (most recent call last):
+    ...
+    ValueError: Value 'e' is already mapped from 'a'
+    >>> m.update(g='h', i='h')
+    Traceback (most recent call last):
+    ...
+    ValueError: Value 'h' is mapped from both 'g' and 'i'
+    >>> len(m)
+    3
+    """
+
+    _forward: dict
+    _inverse: dict
+
+    def __init__(self, *args, **kwargs):
+        self._forward = {}
+        self._inverse = {}
+        self.update(*args, **kwargs)
+
+    @property
+    def inverse(self) -> BidirectionalMap:
+        """
+        The mapping of values to keys, sharing the same dicts.
+        """
+        inverse = object.__new__(type(self))
+        inverse._forward, inverse._inverse = self._inverse, self._forward
+        return inverse
+
+    def __getitem__(self, key):
+        return self._forward[key]
+
+    def __contains__(self, key):
+        return key in self._forward
+
+    def __iter__(self):
+        return iter(self._forward)
+
+    def __len__(self):
+        return len(self._forward)
+
+    def __setitem__(self, key, value):
+        if value in self._inverse:
+            owner = self._inverse[value]
+            if owner == key:
+                return
+            raise ValueError(f"Value {value!r} is already mapped from {owner!r}")
+        if key in self._forward:
+            del self._inverse[self._forward[key]]
+        self._forward[key] = value
+        self._inverse[value] = key
+
+    def __delitem__(self, key):
+        del self._inverse[self._forward.pop(key)]
+
+    def update(self, *args, **kwargs):
+        items = dict(_dict_items(*args, **kwargs))
+        inverse = dict(zip(items.values(), items))
+        if len(inverse) != len(items):
+            for key, value in items.items():
+                if inverse[value] != key:
+                    raise ValueError(
+                        f"Value {value!r} is mapped from both "
+                        f"{key!r} and {inverse[value]!r}"
+                    )
+        for value in inverse.keys() & self._inverse.keys():
+            owner = self._inverse[value]
+            if owner not in items:
+                raise ValueError(f"Value {value!r} is already mapped from {owner!r}")
+        for key in items.keys() & self._forward.keys():
+            del self._inverse[self._forward[key]]
+        self._forward.update(items)
+        self._inverse.update(inverse)
+
+    def clear(self):
+        self._forward.clear()
+        self._inverse.clear()
+
+    def copy(self):
+        result = object.__new__(type(self))
+        result._forward = self._forward.copy()
+        result._inverse = self._inverse.copy()
+        return result
+
+    __copy__ = copy
+
+    def __reduce__(self):
+        return type(self), (dict(self._forward),)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._forward!r})'
+
+
+# the number of bits set in an int (int.bit_count on Python 3.10 and later)
+_popcount = getattr(int, 'bit_count', lambda number: bin(number).count('1'))
+
+
+class _TrieCollision(tuple):
+    """
+    The entries of a _Trie whose keys share a hash, as
+    ``(hash, ((key, value), ...))``.
+    """
+
+    def without(self, key):
+        """
+        Return the entries but key's, as a leaf if only one remains.
+        """
+        hash_, pairs = self
+        remaining = tuple(
+            pair for pair in pairs if not (pair[0] is key or pair[0] == key)
+        )
+        if len(remaining) == len(pairs):
+            raise KeyError(key)
+        if len(remaining) == 1:
+            return (hash_, *remaining[0])
+        return type(self)((hash_, remaining))
+
+
+class _TrieNode:
+    """
+    A level of a _Trie, with an entry for each 5-bit chunk of a hash
+    set in ``bitmap``. Each entry is a leaf ``(hash, key, value)``,
+    a _TrieCollision or a _TrieNode a level deeper.
+    """
+
+    __slots__ = 'bitmap', 'entries'
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+    def __iter__(self):
+        for entry in self.entries:
+            if isinstance(entry, _TrieNode):
+                yield from entry
+            elif isinstance(entry, _TrieCollision):
+                yield from entry[1]
+            else:
+                yield entry[1:]
+
+    def _replace(self, index, entry):
+        entries = (*self.entries[:index], entry, *self.entries[index + 1 :])
+        return type(self)(self.bitmap, entries)
+
+    @classmethod
+    def _split(cls, shift, first, second):
+        """
+        A node holding two entries whose hashes differ.
+        """
+        chunk, other = (first[0] >> shift) & 31, (second[0] >> shift) & 31
+        if chunk == other:
+            return cls(1 << chunk, (cls._split(shift + 5, first, second),))
+        entries = (first, second) if chunk < other else (second, first)
+        return cls(1 << chunk | 1 << other, entries)
+
+    def assoc(self, shift, hash_, key, value):
+        """
+        Return a node like this one but with key mapped to value,
+        and whether the key was added.
+        """
+        bit = 1 << ((hash_ >> shift) & 31)
+        index = _popcount(self.bitmap & (bit - 1))
+        if not self.bitmap & bit:
+            entries = (
+                *self.entries[:index],
+                (hash_, key, value),
+                *self.entries[index:],
+            )
+            return type(self)(self.bitmap | bit, entries), True
+        entry = self.entries[index]
+        added = True
+        if isinstance(entry, _TrieNode):
+            replacement, added = entry.assoc(shift + 5, hash_, key, value)
+        elif entry[0] != hash_:
+            replacement = self._split(shift + 5, entry, (hash_, key, value))
+        elif isinstance(entry, _TrieCollision):
+            pairs = entry[1]
+            for position, (existing, _) in enumerate(pairs):
+                if existing is key or existing == key:
+                    pair = (existing, value)
+                    pairs = (*pairs[:position], pair, *pairs[position + 1 :])
+                    added = False
+                    break
+            else:
+                pairs += ((key, value),)
+            replacement = _TrieCollision((hash_, pairs))
+        elif entry[1] is key or entry[1] == key:
+            replacement, added = (hash_, entry[1], value), False
+        else:
+            pairs = (entry[1:], (key, value))
+            replacement = _TrieCollision((hash_, pairs))
+        return self._replace(index, replacement), added
+
+    def dissoc(self, shift, hash_, key):
+        """
+        Return a node like this one but without key, or None if that
+        leaves it empty. Raise KeyError if key isn't present.
+        """
+        bit = 1 << ((hash_ >> shift) & 31)
+        if not self.bitmap & bit:
+            raise KeyError(key)
+        index = _popcount(self.bitmap & (bit - 1))
+        entry = self.entries[index]
+        if isinstance(entry, _TrieNode):
+            replacement = entry.dissoc(shift + 5, hash_, key)
+            if replacement is not None and len(replacement.entries) == 1:
+                # a lone leaf or collision may be found at this level
+                (lone,) = replacement.entries
+                if not isinstance(lone, _TrieNode):
+                    replacement = lone
+        elif entry[0] != hash_:
+            raise KeyError(key)
+        elif isinstance(entry, _TrieCollision):
+            replacement = entry.without(key)
+        elif entry[1] is key or entry[1] == key:
+            replacement = None
+        else:
+            raise KeyError(key)
+        if replacement is not None:
+            return self._replace(index, replacement)
+        if self.bitmap == bit:
+            return None
+        entries = self.entries[:index] + self.entries[index + 1 :]
+        return type(self)(self.bitmap & ~bit, entries)
+
+
+class _Trie(collections.abc.Mapping):
+    """
+    A hash array mapped trie: an immutable mapping whose ``set``
+    and ``delete`` return a new trie sharing all but the nodes on
+    the path to the changed key.
+
+    >>> trie = _Trie.from_items([('a', 1), ('b', 2)])
+    >>> changed = trie.set('a', 3).delete('b')
+    >>> sorted(trie.items()), sorted(changed.items())
+    ([('a', 1), ('b', 2)], [('a', 3)])
+    >>> changed['b']
+    Traceback (most recent call last):
+    ...
+    KeyError: 'b'
+
+    Keys whose hashes are equal are kept together.
+
+    >>> collided = _Trie.from_items([(-1, 'a'), (-2, 'b')]).delete(-2)
+    >>> dict(collided)
+    {-1: 'a'}
+    """
+
+    __slots__ = '_length', '_root'
+
+    def __init__(self, root=None, length=0):
+        self._root = _TrieNode(0, ()) if root is None else root
+        self._length = length
+
+    @classmethod
+    def from_items(cls, items):
+        trie = cls()
+        for key, value in items:
+            trie = trie.set(key, value)
+        return trie
+
+    def set(self, key, value):
+        root, added = self._root.assoc(0, hash(key), key, value)
+        return type(self)(root, self._length + added)
 
-    def __len__(self):
-        return super().__len__() // 2
+    def delete(self, key):
+        return type(self)(self._root.dissoc(0, hash(key), key), self._length - 1)
 
-    def pop(self, key, *args, **kwargs):
-        mirror = self[key]
-        super().__delitem__(mirror)
-        return super().pop(key, *args, **kwargs)
+    def __getitem__(self, key):
+        hash_, node, shift = hash(key), self._root, 0
+        while True:
+            bit = 1 << ((hash_ >> shift) & 31)
+            if not node.bitmap & bit:
+                raise KeyError(key)
+            entry = node.entries[_popcount(node.bitmap & (bit - 1))]
+            if not isinstance(entry, _TrieNode):
+                break
+            node, shift = entry, shift + 5
+        if entry[0] == hash_:
+            pairs = entry[1] if isinstance(entry, _TrieCollision) else (entry[1:],)
+            for existing, value in pairs:
+                if existing is key or existing == key:
+                    return value
+        raise KeyError(key)
 
-    def update(self, *args, **kwargs):
-        # build a dictionary using the default constructs
-        d = dict(*args, **kwargs)
-        # build this dictionary using transformed keys.
-        for item in d.items():
-            self.__setitem__(*item)
+    def __iter__(self):
+        return (key for key, _ in self._root)
+
+    def __len__(self):
+        return self._length
 
 
 class FrozenDict(collections.abc.Mapping, collections.abc.Hashable):
@@ -778,10 +3386,15 @@ class FrozenDict(collections.abc.Mapping, collections.abc.Hashable):
     ...
     TypeError: 'FrozenDict' object does not support item assignment
 
-    >>> a.update(y=3)
-    Traceback (most recent call last):
-    ...
-    AttributeError: 'FrozenDict' object has no attribute 'update'
+    Changes are derived as new FrozenDicts, leaving the original
+    unchanged.
+
+    >>> a.update(y=3) == dict(a=1, b=2, y=3)
+    True
+    >>> a.set('a', 0).delete('b') == dict(a=0)
+    True
+    >>> a == dict(a=1, b=2)
+    True
 
     Copies should compare equal
 
@@ -800,22 +3413,44 @@ class FrozenDict(collections.abc.Mapping, collections.abc.Hashable):
     True
     >>> a.copy() is not a
     True
+
+    The hash depends only on the items, in any order, and is
+    computed once.
+
+    >>> mixed = FrozenDict({None: 1, 'a': 'b'})
+    >>> hash(mixed) == hash(FrozenDict({'a': 'b', None: 1}))
+    True
     """
 
-    __slots__ = ['__data']
+    __slots__ = ['__data', '__hash', '__trie']
 
     def __new__(cls, *args, **kwargs):
         self = super().__new__(cls)
         self.__data = dict(*args, **kwargs)
+        self.__hash = None
+        self.__trie = None
+        return self
+
+    @classmethod
+    def __from_trie(cls, trie):
+        self = cls.__new__(cls)
+        self.__data = self.__trie = trie
         return self
 
+    def __getstate__(self):
+        # hashes of str and bytes vary between processes, so drop the
+        # cache and store a trie as a dict
+        return None, {'_FrozenDict__data': dict(self.__data.items())}
+
     # Container
     def __contains__(self, key):
         return key in self.__data
 
     # Hashable
     def __hash__(self):
-        return hash(tuple(sorted(self.__data.items())))
+        if self.__hash is None:
+            self.__hash = hash(frozenset(self.__data.items()))
+        return self.__hash
 
     # Mapping
     def __iter__(self):
@@ -834,13 +3469,63 @@ class FrozenDict(collections.abc.Mapping, collections.abc.Hashable):
     # override eq to recognize underlying implementation
     def __eq__(self, other):
         if isinstance(other, FrozenDict):
-            other = other.__data
+            hashes = self.__hash, other.__hash
+            if None not in hashes and hashes[0] != hashes[1]:
+                return False
+            return self.__data == other.__data
         return self.__data.__eq__(other)
 
     def copy(self):
         "Return a shallow copy of self"
         return copy.copy(self)
 
+    def __as_trie(self):
+        # convert once, so that each change from here costs O(log n)
+        if self.__trie is None:
+            self.__trie = _Trie.from_items(self.__data.items())
+        return self.__trie
+
+    def set(self, key, value):
+        """
+        Return a FrozenDict like self but with key mapped to value.
+
+        Derived FrozenDicts share structure with the one they came
+        from, in a hash array mapped trie, so each change costs
+        O(log n) rather than a copy. They iterate in hash order
+        rather than insertion order.
+
+        >>> base = FrozenDict(a=1)
+        >>> base.set('b', 2).set('a', 3) == dict(a=3, b=2)
+        True
+        """
+        return self.__from_trie(self.__as_trie().set(key, value))
+
+    def delete(self, key):
+        """
+        Return a FrozenDict like self but without key.
+
+        >>> FrozenDict(a=1, b=2).delete('a') == dict(b=2)
+        True
+        >>> FrozenDict(a=1).delete('b')
+        Traceback (most recent call last):
+        ...
+        KeyError: 'b'
+        """
+        return self.__from_trie(self.__as_trie().delete(key))
+
+    def update(self, *args, **kwargs):
+        """
+        Return a FrozenDict like self but with the items supplied,
+        as ``dict.update`` accepts them.
+
+        >>> FrozenDict(a=1).update([('b', 2)], c=3) == dict(a=1, b=2, c=3)
+        True
+        """
+        trie = self.__as_trie()
+        for key, value in _dict_items(*args, **kwargs):
+            trie = trie.set(key, value)
+        return self.__from_trie(trie)
+
 
 class Enumeration(ItemsAsAttributes, BijectiveMap):
     """
@@ -891,6 +3576,206 @@ class Enumeration(ItemsAsAttributes, BijectiveMap):
         return (self[name] for name in self.names)
 
 
+class DenseEnumeration(dict):
+    """
+    An immutable :class:`Enumeration` whose ``names`` and ``codes``
+    are tuples computed once, in the order supplied.
+
+    Like Enumeration, it's a dict of each name to its code and each
+    code to its name, so decoding is a single dict lookup, costing
+    about the same as on Enumeration.
+
+    >>> e = DenseEnumeration('a b c')
+    >>> e['a']
+    0
+
+    >>> e.a
+    0
+
+    >>> e[1]
+    'b'
+
+    >>> e.names
+    ('a', 'b', 'c')
+
+    >>> e.codes
+    (0, 1, 2)
+
+    >>> e.get('d') is None
+    True
+
+    >>> len(e), list(e)
+    (6, ['a', 'b', 'c', 0, 1, 2])
+
+    >>> e['d'] = 3
+    Traceback (most recent call last):
+    ...
+    TypeError: 'DenseEnumeration' object is immutable
+
+    Codes need not start with 0 nor be contiguous.
+
+    >>> e = DenseEnumeration('a b c', (3, 1, 5))
+    >>> e['a']
+    3
+    >>> e[5]
+    'c'
+    >>> e[4]
+    Traceback (most recent call last):
+    ...
+    KeyError: 4
+    >>> e.get(0, 'unknown')
+    'unknown'
+    >>> e.b
+    1
+    >>> e.d
+    Traceback (most recent call last):
+    ...
+    AttributeError: d
+
+    Each name and each code may appear only once.
+
+    >>> DenseEnumeration('a b a')
+    Traceback (most recent call last):
+    ...
+    ValueError: Name 'a' is enumerated more than once
+    >>> DenseEnumeration('a b', (1, 1))
+    Traceback (most recent call last):
+    ...
+    ValueError: Code 1 is enumerated more than once
+
+    To decode (or encode) many at once, resolve them in bulk.
+    Where the codes are dense ints, they're laid out in a list
+    indexed by code, decoding them all at once.
+
+    >>> e.decode_many([5, 1, 3, 5])
+    ['c', 'b', 'a', 'c']
+    >>> e.encode_many('cab')
+    [5, 3, 1]
+    >>> e.decode_many([1, 2])
+    Traceback (most recent call last):
+    ...
+    KeyError: 2
+    >>> e.decode_many(['a'])
+    Traceback (most recent call last):
+    ...
+    KeyError: 'a'
+
+    Sparse codes are decoded through the dict alone.
+
+    >>> sparse = DenseEnumeration(['a', 'b'], [2**40, -(2**40)])
+    >>> sparse._table, sparse.decode_many([-(2**40), 2**40])
+    (None, ['b', 'a'])
+
+    An existing Enumeration may be compiled.
+
+    >>> DenseEnumeration.from_enumeration(Enumeration('x y'))
+    DenseEnumeration(('x', 'y'), (0, 1))
+    """
+
+    __slots__ = '_codes', '_gapless', '_names', '_offset', '_table'
+
+    def __init__(self, names, codes=None):
+        if isinstance(names, str):
+            names = names.split()
+        if codes is None:
+            codes = itertools.count()
+        encode = {}
+        for name, code in zip(names, codes):
+            if name in encode:
+                raise ValueError(f"Name {name!r} is enumerated more than once")
+            encode[name] = code
+        decode = {}
+        for name, code in encode.items():
+            if code in decode or code in encode:
+                raise ValueError(f"Code {code!r} is enumerated more than once")
+            decode[code] = name
+        dict.update(self, encode)
+        dict.update(self, decode)
+        self._names = tuple(encode)
+        self._codes = tuple(decode)
+        self._table, self._offset = self._tabulate(decode)
+        self._gapless = self._table is not None and len(self._table) == len(decode)
+
+    @staticmethod
+    def _tabulate(decode):
+        """
+        Lay out the names in a list indexed by code (less an offset),
+        if the codes are ints dense enough to fill half of it.
+        """
+        if not decode or not all(type(code) is int for code in decode):
+            return None, 0
+        low, high = min(decode), max(decode)
+        # start from zero where that leaves it dense, saving a subtraction
+        offset = 0 if 0 <= low and high < 2 * len(decode) else low
+        if high - offset >= 2 * len(decode):
+            return None, 0
+        table = [_vacant] * (high - offset + 1)
+        for code, name in decode.items():
+            table[code - offset] = name
+        return table, offset
+
+    @classmethod
+    def from_enumeration(cls, enumeration):
+        names = list(enumeration.names)
+        return cls(names, [enumeration[name] for name in names])
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def codes(self):
+        return self._codes
+
+    def _decode(self, code):
+        if isinstance(code, str):
+            raise KeyError(code)
+        return self[code]
+
+    def decode_many(self, codes):
+        """
+        Return the name for each of codes.
+
+        Dense codes are resolved together by indexing the table,
+        falling back to one at a time to report a missing code.
+        """
+        codes = indexes = list(codes)
+        if self._table is not None and len(codes) > 1:
+            with contextlib.suppress(IndexError, TypeError):
+                if self._offset:
+                    offsets = itertools.repeat(self._offset)
+                    indexes = list(map(operator.sub, codes, offsets))
+                if min(indexes) >= 0:
+                    names = operator.itemgetter(*indexes)(self._table)
+                    if self._gapless or _vacant not in names:
+                        return list(names)
+        return list(map(self._decode, codes))
+
+    def encode_many(self, names):
+        """
+        Return the code for each of names.
+        """
+        return list(map(self.__getitem__, names))
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__!r} object is immutable")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return type(self), (self._names, self._codes)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._names!r}, {self._codes!r})'
+
+
 class Everything:
     """
     A collection "containing" every possible thing.
@@ -1035,6 +3920,148 @@ class FreezableDefaultDict(collections.defaultdict):
         self._frozen = lambda key: self.default_factory()
 
 
+class _StripedLocks:
+    """
+    Mix-in guarding the key space with a fixed number of locks, each
+    key hashed to one of them, so threads working on different keys
+    seldom contend.
+    """
+
+    stripes = 16
+
+    _locks: tuple
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls, *args, **kwargs)
+        self._reset_locks()
+        return self
+
+    def _reset_locks(self):
+        self._locks = tuple(threading.RLock() for _ in range(self.stripes))
+
+    def _lock(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold all of the locks (always acquired in the same order).
+        """
+        with contextlib.ExitStack() as stack:
+            for lock in self._locks:
+                stack.enter_context(lock)
+            yield
+
+    def __getstate__(self):
+        state = vars(self).copy()
+        del state['_locks']
+        return state
+
+
+class ConcurrentKeyTransformingDict(_StripedLocks, KeyTransformingDict):
+    """
+    A KeyTransformingDict whose updates of an item and its original
+    key happen together, guarded by a lock for the transformed key.
+
+    >>> d = ConcurrentKeyTransformingDict(a=1)
+    >>> d['b'] = 2
+    >>> d.setdefault('c', 3)
+    3
+    >>> d.pop('a')
+    1
+    >>> d.popitem()
+    ('c', 3)
+    >>> clone = d.copy()
+    >>> clone, clone._locks is d._locks
+    ({'b': 2}, False)
+    """
+
+    def _update(self, items):
+        transform = self.transform_key
+        setdefault = self._originals.setdefault
+        for key, value in items:
+            transformed = transform(key)
+            with self._lock(transformed):
+                dict.__setitem__(self, transformed, value)
+                setdefault(transformed, key)
+
+    def __setitem__(self, key, val):
+        transformed = self.transform_key(key)
+        with self._lock(transformed):
+            dict.__setitem__(self, transformed, val)
+            self._originals.setdefault(transformed, key)
+
+    def __delitem__(self, key):
+        transformed = self.transform_key(key)
+        with self._lock(transformed):
+            dict.__delitem__(self, transformed)
+            del self._originals[transformed]
+
+    def setdefault(self, key, *args, **kwargs):
+        transformed = self.transform_key(key)
+        with self._lock(transformed):
+            self._originals.setdefault(transformed, key)
+            return dict.setdefault(self, transformed, *args, **kwargs)
+
+    def pop(self, key, *args, **kwargs):
+        transformed = self.transform_key(key)
+        with self._lock(transformed):
+            self._originals.pop(transformed, None)
+            return dict.pop(self, transformed, *args, **kwargs)
+
+    def popitem(self):
+        with self._locked():
+            return super().popitem()
+
+    def clear(self):
+        with self._locked():
+            super().clear()
+
+    def copy(self):
+        with self._locked():
+            result = super().copy()
+        result._reset_locks()
+        return result
+
+    def __reduce__(self):
+        # snapshot the items and their original keys together
+        with self._locked():
+            state = self.__getstate__()
+            state['_originals'] = dict(self._originals)
+            return type(self), (), state, None, iter(list(dict.items(self)))
+
+
+class ConcurrentFoldedCaseKeyedDict(ConcurrentKeyTransformingDict, FoldedCaseKeyedDict):
+    """
+    A thread-safe FoldedCaseKeyedDict.
+
+    >>> d = ConcurrentFoldedCaseKeyedDict(Accept='*/*')
+    >>> d['ACCEPT']
+    '*/*'
+    >>> d.matching_key_for('accept')
+    'Accept'
+    """
+
+
+class ConcurrentFreezableDefaultDict(_StripedLocks, FreezableDefaultDict):
+    """
+    A FreezableDefaultDict calling the default factory only once for
+    each missing key, even when threads race to supply it.
+
+    >>> calls = []
+    >>> dd = ConcurrentFreezableDefaultDict(lambda: calls.append(1) or len(calls))
+    >>> dd['a'], dd['a'], dd['b']
+    (1, 1, 2)
+    """
+
+    def __missing__(self, key):
+        with self._lock(key):
+            # another thread may have supplied it while this one waited
+            if key in self:
+                return dict.__getitem__(self, key)
+            return super().__missing__(key)
+
+
 class Accumulator:
     def __init__(self, initial=0):
         self.val = initial
@@ -1044,6 +4071,33 @@ class Accumulator:
         return self.val
 
 
+def _alias_table(weights: Sequence[float]) -> tuple[list[float], list[int]]:
+    """
+    Build the tables for Walker's alias method (per Vose) of
+    sampling indexes of weights in proportion to those weights.
+
+    Each index i is chosen (uniformly) and then kept with probability
+    ``probabilities[i]`` or otherwise exchanged for ``aliases[i]``.
+
+    >>> _alias_table([1, 3])
+    ([0.5, 1.0], [1, 1])
+    """
+    count = len(weights)
+    total = sum(weights)
+    scaled = [weight * count / total for weight in weights]
+    probabilities = [1.0] * count
+    aliases = list(range(count))
+    small = [index for index, weight in enumerate(scaled) if weight < 1]
+    large = [index for index, weight in enumerate(scaled) if weight >= 1]
+    while small and large:
+        lesser, greater = small.pop(), large.pop()
+        probabilities[lesser] = scaled[lesser]
+        aliases[lesser] = greater
+        scaled[greater] -= 1 - scaled[lesser]
+        (small if scaled[greater] < 1 else large).append(greater)
+    return probabilities, aliases
+
+
 class WeightedLookup(RangeMap):
     """
     Given parameters suitable for a dict representing keys
@@ -1076,6 +4130,21 @@ class WeightedLookup(RangeMap):
     >>> ratio = choices.count('a') / choices.count('b')
     >>> .4 < ratio < .6
     True
+
+    Draws are made in constant time from an alias table (built on
+    first use and rebuilt if the lookup is modified). ``.sample(k)``
+    makes k draws at once (with replacement). Both accept a
+    :class:`random.Random` instance for a reproducible or
+    thread-local stream.
+
+    >>> rng = random.Random(42)
+    >>> sampled = lk.sample(1000, rng)
+    >>> sampled == WeightedLookup(a=1, b=2).sample(1000, random.Random(42))
+    True
+    >>> .4 < sampled.count('a') / sampled.count('b') < .6
+    True
+    >>> lk.random(rng) in ['a', 'b']
+    True
     """
 
     def __init__(self, *args, **kwargs):
@@ -1085,10 +4154,257 @@ class WeightedLookup(RangeMap):
         indexes = map(Accumulator(), raw.values())
         super().__init__(zip(indexes, raw.keys()), key_match_comparator=operator.lt)
 
-    def random(self):
-        lower, upper = self.bounds()
-        selector = random.random() * upper
-        return self[selector]
+    # the alias table and the index from which it was built
+    _alias: tuple[Any, tuple[list, list[float], list[int]]] | None = None
+
+    def _get_alias(self) -> tuple[list, list[float], list[int]]:
+        index = self._get_index_()
+        if self._alias is None or self._alias[0] is not index:
+            bounds, _ = index
+            weights = map(operator.sub, bounds, [0, *bounds])
+            values = [dict.__getitem__(self, bound) for bound in bounds]
+            self._alias = index, (values, *_alias_table(list(weights)))
+        return self._alias[1]
+
+    def __getstate__(self):
+        # like the index, the alias table is derived, so is rebuilt
+        state = super().__getstate__()
+        state.pop('_alias', None)
+        return state
+
+    def random(self, rng: Random | None = None):
+        """
+        Select a value at random in proportion to its weight.
+        """
+        return self.sample(1, rng)[0]
+
+    def sample(self, k: int, rng: Random | None = None) -> list:
+        """
+        Select k values at random (with replacement) in
+        proportion to their weights.
+        """
+        values, probabilities, aliases = self._get_alias()
+        uniform = (rng or random).random
+        count = len(values)
+        result = []
+        for _ in range(k):
+            selector = uniform() * count
+            index = int(selector)
+            if selector - index >= probabilities[index]:
+                index = aliases[index]
+            result.append(values[index])
+        return result
+
+
+def _check_weight(weight) -> None:
+    if weight < 0:
+        raise ValueError(f"Weight {weight!r} is negative")
+
+
+class DynamicWeightedLookup:
+    """
+    Like :class:`WeightedLookup`, but whose weights may be changed,
+    each change taking O(log n) rather than a rebuild.
+
+    >>> lk = DynamicWeightedLookup(a=1, b=2)
+
+    [0, 1) -> a
+    [1, 3) -> b
+
+    >>> lk[.5], lk[1.5]
+    ('a', 'b')
+    >>> lk.bounds()
+    (1, 3)
+    >>> lk.random() in ['a', 'b']
+    True
+
+    Assign weights to new or existing keys, or remove them.
+
+    >>> lk.set_weight('c', 3)
+    >>> lk.set_weight('a', 2)
+
+    [0, 2) -> a
+    [2, 4) -> b
+    [4, 7) -> c
+
+    >>> lk[1.5], lk[6.5]
+    ('a', 'c')
+    >>> lk.remove('b')
+    >>> lk[2.5], lk.weight('c'), len(lk)
+    ('c', 3, 2)
+    >>> lk[5]
+    Traceback (most recent call last):
+    ...
+    KeyError: 5
+    >>> sorted(lk)
+    ['a', 'c']
+    >>> lk.set_weight('a', -1)
+    Traceback (most recent call last):
+    ...
+    ValueError: Weight -1 is negative
+
+    >>> sampled = lk.sample(1000, random.Random(0))
+    >>> .5 < sampled.count('a') / sampled.count('c') < .85
+    True
+
+    The cumulative weights are kept in a Fenwick (binary indexed)
+    tree, so lookups, draws and changes to weights are each O(log n).
+    """
+
+    _vacant = object()
+
+    def __init__(self, *args, **kwargs) -> None:
+        raw = dict(*args, **kwargs)
+        self._keys: list = list(raw)
+        self._weights: list = list(raw.values())
+        for weight in self._weights:
+            _check_weight(weight)
+        self._slots = {key: slot for slot, key in enumerate(self._keys)}
+        self._free: list[int] = []
+        # the tree is one-based; element i holds the sum of the weights
+        # of the (i & -i) slots ending with slot i - 1.
+        self._tree = [0, *self._weights]
+        for index in range(1, len(self._tree)):
+            parent = index + (index & -index)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[index]
+
+    def _prefix(self, count: int):
+        """
+        Return the total weight of the first count slots.
+        """
+        total = 0
+        while count:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def _add(self, slot: int, delta) -> None:
+        index = slot + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _find(self, position) -> int:
+        """
+        Return the first slot whose cumulative weight exceeds position.
+        """
+        slot = 0
+        step = 1 << len(self._keys).bit_length()
+        while step:
+            index = slot + step
+            if index < len(self._tree) and self._tree[index] <= position:
+                slot = index
+                position -= self._tree[index]
+            step >>= 1
+        return slot
+
+    def __getitem__(self, position):
+        slot = self._find(position)
+        # rounding in sums of float weights may leave a removed slot
+        # a sliver of weight, so pass over any to the next key
+        while slot < len(self._keys) and self._keys[slot] is self._vacant:
+            slot += 1
+        if slot == len(self._keys):
+            raise KeyError(position)
+        return self._keys[slot]
+
+    def get(self, position, default=None):
+        try:
+            return self[position]
+        except KeyError:
+            return default
+
+    def bounds(self) -> tuple[Any, Any]:
+        first = next(
+            (slot for slot, key in enumerate(self._keys) if key is not self._vacant),
+            None,
+        )
+        if first is None:
+            raise IndexError("Cannot find the bounds of an empty lookup")
+        return self._prefix(first + 1), self._prefix(len(self._keys))
+
+    def weight(self, key):
+        return self._weights[self._slots[key]]
+
+    def set_weight(self, key, weight) -> None:
+        """
+        Set the weight for key, adding key if it's not present.
+        """
+        _check_weight(weight)
+        try:
+            slot = self._slots[key]
+        except KeyError:
+            slot = self._allocate(key)
+        self._add(slot, weight - self._weights[slot])
+        self._weights[slot] = weight
+
+    def _allocate(self, key) -> int:
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._weights.append(0)
+            # the new element of the tree covers the preceding slots
+            # back to (but excluding) the one at index & (index - 1).
+            index = slot + 1
+            self._tree.append(self._prefix(slot) - self._prefix(index & (index - 1)))
+        self._slots[key] = slot
+        return slot
+
+    def remove(self, key) -> None:
+        """
+        Remove key (and its weight).
+        """
+        slot = self._slots.pop(key)
+        self._add(slot, -self._weights[slot])
+        self._weights[slot] = 0
+        self._keys[slot] = self._vacant
+        self._free.append(slot)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._slots)
+
+    def __contains__(self, key) -> bool:
+        return key in self._slots
+
+    def random(self, rng: Random | None = None):
+        """
+        Select a key at random in proportion to its weight.
+        """
+        return self.sample(1, rng)[0]
+
+    def sample(self, k: int, rng: Random | None = None) -> list:
+        """
+        Select k keys at random (with replacement) in
+        proportion to their weights.
+        """
+        if k and not self._slots:
+            raise IndexError("Cannot sample from an empty lookup")
+        uniform = (rng or random).random
+        total = self._prefix(len(self._keys))
+        return [self._draw(uniform() * total) for _ in range(k)]
+
+    def _draw(self, position):
+        try:
+            return self[position]
+        except KeyError:
+            # rounding in the sums took the draw past the last key
+            return next(key for key in reversed(self._keys) if key is not self._vacant)
+
+    def __reduce__(self):
+        # rebuild without the removed slots, whose marker is this process's
+        live = (
+            (key, weight)
+            for key, weight in zip(self._keys, self._weights)
+            if key is not self._vacant
+        )
+        return type(self), (list(live),)
 
 
 def set_defaults(__anon_self: dict[str, object], /, **defaults) -> None:
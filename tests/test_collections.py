@@ -1,3 +1,17 @@
+import concurrent.futures
+import copy
+import itertools
+import mmap
+import operator
+import pickle
+import random
+import re
+import struct
+import threading
+
+import jaraco.text
+import pytest
+
 from jaraco import collections
 
 
@@ -25,3 +39,1168 @@ def test_always_lower_keys_dict():
     assert "{'a': 1}" in d
     assert 3 in d
     assert d[3] == d['3'] == 'three'
+
+
+def test_key_transforming_dict_originals():
+    d = AlwaysStringKeysDict({3: 'three'})
+    d['3'] = 'trois'
+    d.update({4: 'four'})
+    assert d.matching_key_for('3') == 3
+    assert d.matching_key_for(4) == 4
+    del d[3]
+    with pytest.raises(KeyError):
+        d.matching_key_for(3)
+    for clone in copy.copy(d), copy.deepcopy(d), pickle.loads(pickle.dumps(d)):
+        assert clone == d
+        assert clone.matching_key_for('4') == 4
+
+
+def test_folded_case_keyed_dict_matching_key():
+    d = collections.FoldedCaseKeyedDict({'Accept': '*/*'})
+    d['ACCEPT'] = 'text/html'
+    for dict_ in d, d.copy(), copy.deepcopy(d):
+        key = dict_.matching_key_for('accept')
+        assert type(key) is jaraco.text.FoldedCase and str(key) == 'Accept'
+    with pytest.raises(KeyError):
+        d.matching_key_for('Host')
+
+
+def test_case_insensitive_dict():
+    d = collections.CaseInsensitiveDict({'Accept': '*/*', 'X-Token': 'a'})
+    d['x-token'] = 'b'
+    d.setdefault('HOST', 'localhost')
+    d.update({'accept': 'text/html'})
+    assert d == collections.CaseInsensitiveDict({
+        'accept': 'text/html',
+        'x-token': 'b',
+        'host': 'localhost',
+    })
+    assert list(d) == ['Accept', 'X-Token', 'HOST']
+    assert dict(d) == {'Accept': 'text/html', 'X-Token': 'b', 'HOST': 'localhost'}
+    assert d.get('ACCEPT') == 'text/html'
+    assert d.pop('x-TOKEN') == 'b'
+    assert 'X-Token' not in d
+    assert list(pickle.loads(pickle.dumps(d)).items()) == list(d.items())
+
+
+def test_key_transforming_dict_bulk():
+    d = AlwaysStringKeysDict.fromkeys([1, 2], 'x')
+    d |= [(2, 'two'), (3, 'three')]
+    d.update({4: 'four'}, five=5)
+    assert d == {'1': 'x', '2': 'two', '3': 'three', '4': 'four', 'five': 5}
+    merged = d | {6: 'six'}
+    assert type(merged) is AlwaysStringKeysDict
+    assert merged['6'] == 'six' and '6' not in d
+    clone = d.copy()
+    clone[7] = 'seven'
+    assert clone.matching_key_for('7') == 7
+    assert '7' not in d and d.matching_key_for('1') == 1
+    with pytest.raises(TypeError):
+        AlwaysStringKeysDict({}, {})
+
+
+def test_case_insensitive_dict_from_case_insensitive_dict():
+    original = collections.CaseInsensitiveDict(Accept='*/*')
+    for derived in (
+        collections.CaseInsensitiveDict(original),
+        original.copy(),
+        original | {},
+    ):
+        assert list(derived) == ['Accept']
+        assert derived['ACCEPT'] == '*/*'
+
+
+def test_case_insensitive_multi_dict_matches_entries():
+    """
+    Compare with a plain list of entries through enough removals
+    to compact the storage.
+    """
+    rand = random.Random(0)
+    multi = collections.CaseInsensitiveMultiDict()
+    entries = []
+    for value in range(2000):
+        key = rand.choice('aAbBcCdD')
+        operation = rand.random()
+        if operation < 0.6:
+            multi.add(key, value)
+            entries.append((key, value))
+        elif operation < 0.8:
+            first = [entry for entry in entries if entry[0].lower() == key.lower()]
+            multi[key] = value
+            entries = [
+                entry
+                for entry in entries
+                if entry[0].lower() != key.lower() or entry is first[0]
+            ]
+            if first:
+                entries[entries.index(first[0])] = (first[0][0], value)
+            else:
+                entries.append((key, value))
+        else:
+            expected = [v for k, v in entries if k.lower() == key.lower()]
+            assert multi.popall(key, []) == expected
+            entries = [entry for entry in entries if entry[0].lower() != key.lower()]
+        assert list(multi.items()) == entries
+        for key in 'abcd':
+            expected = [v for k, v in entries if k.lower() == key]
+            assert multi.getall(key.upper()) == expected
+            assert multi.get(key) == next(iter(expected), None)
+    assert multi._vacancies <= len(multi._keys) // 2
+    assert len(multi) == len({key.lower() for key, value in entries})
+    assert pickle.loads(pickle.dumps(multi)) == multi == multi.copy()
+    assert multi != collections.CaseInsensitiveMultiDict(entries[:-1])
+
+
+def test_case_insensitive_multi_dict_missing_key():
+    multi = collections.CaseInsensitiveMultiDict(Accept='*/*')
+    for lookup in (
+        operator.getitem,
+        operator.delitem,
+        collections.CaseInsensitiveMultiDict.popall,
+        collections.CaseInsensitiveMultiDict.matching_key_for,
+    ):
+        with pytest.raises(KeyError) as info:
+            lookup(multi, 'Content-Type')
+        assert info.value.args == ('Content-Type',)
+    assert multi.getall('Content-Type') == [] and dict(multi) == {'Accept': '*/*'}
+
+
+def test_concurrent_key_transforming_dict_threads():
+    d = collections.ConcurrentFoldedCaseKeyedDict()
+    keys = [f'Key-{number}' for number in range(100)]
+
+    def work(seed):
+        rand = random.Random(seed)
+        for _ in range(2000):
+            key = rand.choice(keys)
+            key = key.upper() if rand.random() < 0.5 else key
+            if rand.random() < 0.5:
+                d[key] = seed
+            else:
+                d.pop(key, None)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(work, range(8)))
+    assert sorted(d._originals) == sorted(d)
+    assert all(d.matching_key_for(key) in (key, key.upper()) for key in d)
+
+
+def test_concurrent_key_transforming_dict_copy():
+    d = collections.ConcurrentKeyTransformingDict(a=1)
+    for clone in copy.copy(d), pickle.loads(pickle.dumps(d)), d.copy():
+        assert clone == d and clone._locks is not d._locks
+        clone['b'] = 2
+        assert clone.matching_key_for('b') == 'b'
+
+
+def test_concurrent_key_transforming_dict_copy_while_writing():
+    d = collections.ConcurrentKeyTransformingDict()
+    done = threading.Event()
+
+    def write():
+        rand = random.Random(0)
+        while not done.is_set():
+            key = rand.randrange(50)
+            if rand.random() < 0.5:
+                d[key] = key
+            else:
+                d.pop(key, None)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(200):
+            for clone in d.copy(), copy.copy(d), pickle.loads(pickle.dumps(d)):
+                assert sorted(clone._originals) == sorted(clone)
+                for key in list(clone):
+                    del clone[key]
+    finally:
+        done.set()
+        writer.join()
+
+
+def test_concurrent_default_dict_factory_called_once():
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def factory():
+        calls.append(None)
+        return []
+
+    dd = collections.ConcurrentFreezableDefaultDict(factory)
+
+    def work(seed):
+        barrier.wait()
+        for key in range(200):
+            dd[key].append(seed)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(work, range(8)))
+    assert len(calls) == 200
+    assert all(sorted(values) == list(range(8)) for values in dd.values())
+
+
+@pytest.mark.parametrize(
+    'keys',
+    [
+        ['a', 'c', 'a', 'z'],
+        ('a', 'c', 'z'),
+        {'a', 'c', 'z'},
+        dict.fromkeys('acz'),
+        list('abcdefghz'),
+        range(3),
+    ],
+)
+@pytest.mark.parametrize('size', [0, 2, 5, 10])
+def test_projection_finite_keys(keys, size):
+    space = {key: ord(key) for key in 'abcdefghij'[:size]}
+    expected = {key: value for key, value in space.items() if key in keys}
+    masked = {key: value for key, value in space.items() if key not in keys}
+    prj = collections.Projection(keys, space)
+    msk = collections.Mask(keys, space)
+    assert dict(prj) == expected and len(prj) == len(expected)
+    assert dict(msk) == masked and len(msk) == len(masked)
+    assert sorted(prj) == list(expected) and list(msk) == list(masked)
+
+
+class _CountedKey(str):
+    """
+    A key counting the comparisons made against it.
+    """
+
+    compared = 0
+
+    __hash__ = str.__hash__
+
+    def __eq__(self, other):
+        type(self).compared += 1
+        return str.__eq__(self, other)
+
+
+def test_projection_looks_up_fewer_keys(monkeypatch):
+    """
+    A projection of a few keys looks each up rather than scanning the space.
+    """
+    monkeypatch.setattr(_CountedKey, 'compared', 0)
+    space = {_CountedKey(number): number for number in range(1000)}
+    prj = collections.Projection(['7', '3', 'x'], space)
+    assert dict(prj) == {'7': 7, '3': 3}
+    assert list(prj) == ['7', '3'] and len(prj) == 2
+    assert _CountedKey.compared <= 10
+
+
+def test_projection_custom_membership():
+    """
+    Keys with their own rules for membership are tested, not enumerated.
+    """
+    keys = collections.FoldedCaseKeyedDict(a=1)
+    space = {'A': 1, 'B': 2}
+    assert dict(collections.Projection(keys, space)) == {'A': 1}
+    assert len(collections.Projection(keys, space)) == 1
+    assert dict(collections.Mask(keys, space)) == {'B': 2}
+    assert len(collections.Mask(keys, space)) == 1
+
+
+@pytest.mark.parametrize(
+    'keys',
+    [['a', 'c', 'a', 'z'], ['c'], [], {'a', 'b'}, str.islower, re.compile('[ab]')],
+)
+def test_projection_compile(keys):
+    records = [
+        dict(a=1, b=2, c=3),
+        dict(c=3),
+        {},
+        dict(A=1, b=2),
+        collections.FreezableDefaultDict(int, a=1),
+    ]
+    for cls in collections.Projection, collections.Mask:
+        compiled = list(cls.apply_many(keys, records))
+        assert compiled == [dict(cls(keys, record)) for record in records]
+    assert 'z' not in records[-1]
+
+
+def test_projection_algebra():
+    space = {key: ord(key) for key in 'abcdefgh'}
+    matchables = [
+        ['a', 'b', 'c'],
+        {'c', 'd', 'z'},
+        re.compile('[b-e]'),
+        re.compile('[eh]'),
+        'abcdefgh'.__contains__,
+        lambda key: key in 'aceg',
+    ]
+
+    def keys(matchable):
+        view = collections.Projection(matchable, space)
+        return {key for key in space if key in view}
+
+    rand = random.Random(0)
+    for _ in range(200):
+        views = [
+            (
+                rand.choice([collections.Projection, collections.Mask]),
+                rand.choice(matchables),
+            )
+            for _ in range(rand.randint(1, 4))
+        ]
+        nested, nested_expected = space, set(space)
+        combined = expected = None
+        for cls, matchable in views:
+            selected = keys(matchable)
+            if cls is collections.Mask:
+                selected = set(space) - selected
+            nested = cls(matchable, nested)
+            nested_expected &= selected
+            operand = cls(matchable, space)
+            if rand.random() < 0.5:
+                operand = ~~operand
+            if combined is None:
+                combined, expected = operand, selected
+            elif rand.random() < 0.5:
+                combined, expected = combined & operand, expected & selected
+            else:
+                combined, expected = combined | operand, expected | selected
+        assert set(combined) == expected
+        assert len(combined) == len(expected)
+        assert set(~combined) == set(space) - expected
+        assert nested._space is space
+        assert dict(nested) == {key: space[key] for key in nested_expected}
+    with pytest.raises(ValueError):
+        collections.Projection(['a'], space) | collections.Mask(['a'], {})
+
+
+def test_projection_union_of_patterns_with_groups():
+    space = dict.fromkeys(['aa', 'bb', 'ab'], 1)
+    first = collections.Projection(re.compile(r'(a)\1'), space)
+    second = collections.Projection(re.compile(r'(b)\1'), space)
+    assert dict(first | second) == {'aa': 1, 'bb': 1}
+    assert dict(~first & ~second) == {'ab': 1}
+
+
+def test_projection_cache_key():
+    space = dict(a=1, b=2)
+    prj = collections.Projection(str.islower, space, cache_key=len)
+    msk = collections.Mask(['a'], space, cache_key=len)
+    assert list(prj) == ['a', 'b'] and len(msk) == 1
+    space['C'] = 3
+    assert list(prj) == ['a', 'b'] and len(prj) == 2 and list(msk) == ['b', 'C']
+    del space['a']
+    space['d'] = 4
+    # an unchanged cache key leaves the keys resolved before
+    assert list(prj) == ['a', 'b']
+    space['e'] = 5
+    assert list(prj) == ['b', 'd', 'e'] and len(msk) == 4
+
+
+@pytest.mark.parametrize(
+    'make_executor',
+    [
+        concurrent.futures.ThreadPoolExecutor,
+        concurrent.futures.ProcessPoolExecutor,
+    ],
+)
+def test_dict_map_executor(make_executor):
+    source = {key: -key for key in range(100)}
+    with make_executor(2) as executor:
+        result = collections.dict_map(abs, source, executor=executor, chunksize=10)
+    assert result == collections.dict_map(abs, source)
+    assert list(result) == list(source)
+
+
+def test_mapped_view():
+    source = dict(a=[1], b=[2])
+    view = collections.MappedView(sum, source)
+    assert view == {'a': 1, 'b': 2}
+    assert 'a' in view and 'z' not in view
+    with pytest.raises(KeyError):
+        view['z']
+    source['c'] = [3]
+    assert view.get('c') == 3 and len(view) == 3
+
+
+def test_mapped_view_empty():
+    view = collections.MappedView(str, {})
+    assert len(view) == 0 and list(view) == [] and view.get('a') is None
+    with pytest.raises(KeyError):
+        view['a']
+
+
+def test_mapped_view_drops_removed_keys():
+    source = {key: [key] for key in range(100)}
+    view = collections.MappedView(sum, source)
+    assert dict(view) == {key: key for key in source}
+    del source[0]
+    assert view.get(0) is None and 0 not in view._results
+    for key in range(100, 1000):
+        del source[key - 99]
+        source[key] = [key]
+        assert view[key] == key
+        assert len(view._results) <= len(source) * 3 // 2 + 1
+
+
+def test_dict_stack_index():
+    """
+    Compare with a naive resolution of the scopes through a variety
+    of changes, both through the index and around it.
+    """
+    rand = random.Random(0)
+    stack = collections.DictStack([dict(a=0)])
+    for step in range(1000):
+        key = rand.choice('abcdef')
+        operation = rand.randrange(8)
+        if operation == 0:
+            stack.push({key: step})
+        elif operation == 1 and list.__len__(stack) > 1:
+            stack.pop()
+        elif operation == 2:
+            stack[key] = step
+        elif operation == 3 and key in list.__getitem__(stack, -1):
+            del stack[key]
+        elif operation == 4:
+            stack.insert(rand.randrange(2), {key: step})
+        elif operation == 5 and list.__len__(stack) > 1:
+            stack.pop(0)
+        elif operation == 6:
+            stack.extend([{key: step}])
+        expected = {}
+        for scope in list.__iter__(stack):
+            expected.update(scope)
+        assert dict(stack) == expected
+        assert len(stack) == len(expected)
+        assert sorted(stack) == sorted(expected)
+        assert all((key in stack) == (key in expected) for key in 'abcdefg')
+
+
+def test_dict_stack_copies():
+    stack = collections.DictStack([dict(a=1), dict(b=2)])
+    assert stack['a'] == 1
+    for clone in (
+        copy.copy(stack),
+        copy.deepcopy(stack),
+        pickle.loads(pickle.dumps(stack)),
+    ):
+        assert list.__len__(clone) == 2 and dict(clone) == dict(a=1, b=2)
+        clone.push(dict(c=3))
+        clone['a'] = 0
+        assert 'c' not in stack and stack.get('c') is None
+        assert dict(stack) == dict(a=1, b=2)
+
+
+def test_persistent_dict_stack_forks():
+    """
+    Compare forks with naive stacks of copied scopes.
+    """
+    rand = random.Random(0)
+    stacks = [(collections.PersistentDictStack([dict(a=0)]), [dict(a=0)])]
+    for step in range(1000):
+        stack, scopes = rand.choice(stacks)
+        key = rand.choice('abcdef')
+        operation = rand.randrange(6)
+        if operation == 0:
+            stacks.append((stack.fork(), [dict(scope) for scope in scopes]))
+        elif operation == 1:
+            stack.push({key: step})
+            scopes.append({key: step})
+        elif operation == 2 and len(scopes) > 1:
+            assert stack.pop() == scopes.pop()
+        elif operation == 3 and scopes:
+            stack[key] = step
+            scopes[-1][key] = step
+        elif operation == 4 and key in scopes[-1]:
+            del stack[key]
+            del scopes[-1][key]
+        elif operation == 5 and scopes:
+            stack.clear()
+            scopes[-1] = {}
+        for stack, scopes in stacks:
+            expected = {}
+            for scope in scopes:
+                expected.update(scope)
+            assert all((key in stack) == (key in expected) for key in 'abcdefg')
+            assert all(stack[key] == expected[key] for key in expected)
+            assert dict(stack) == expected
+            assert len(stack) == len(expected)
+
+
+def test_persistent_dict_stack_shares_scopes():
+    base = collections.PersistentDictStack([dict(a=1), dict(b=2)])
+    fork = base.fork()
+    assert fork._frame is base._frame
+    fork['c'] = 3
+    assert fork._frame.parent is base._frame.parent
+    assert 'c' not in base
+    with pytest.raises(IndexError):
+        collections.PersistentDictStack()['a'] = 1
+
+
+def test_persistent_dict_stack_push_copies_nothing():
+    stack = collections.PersistentDictStack([dict.fromkeys(range(1000), 0)])
+    assert len(stack) == 1000
+    for depth in range(1, 100):
+        stack.push({depth: depth})
+        assert stack[depth] == depth and stack[999] == 0
+    frame = stack._frame
+    while frame is not None:
+        assert frame._merged is None
+        frame = frame.parent
+
+
+def test_persistent_dict_stack_clear():
+    base = collections.PersistentDictStack([dict(a=1), dict(b=2)])
+    fork = base.fork()
+    fork.clear()
+    assert dict(fork) == dict(a=1) and len(fork) == 1
+    assert dict(base) == dict(a=1, b=2)
+    base.clear()
+    base.clear()
+    assert dict(base) == dict(a=1)
+    collections.PersistentDictStack().clear()
+
+
+def test_bidirectional_map():
+    rand = random.Random(0)
+    m = collections.BidirectionalMap()
+    for _ in range(500):
+        pairs = [
+            (rand.randrange(10), rand.randrange(10)) for _ in range(rand.randrange(3))
+        ]
+        before = dict(m)
+        try:
+            if len(pairs) == 1:
+                m.__setitem__(*pairs[0])
+            else:
+                m.update(pairs)
+        except ValueError:
+            assert dict(m) == before
+        else:
+            before.update(pairs)
+            assert dict(m) == before
+        if m and rand.random() < 0.2:
+            del m.inverse[rand.choice(list(m.values()))]
+        assert dict(m.inverse) == {value: key for key, value in m.items()}
+        assert len(m.inverse) == len(m)
+    clone = m.copy()
+    clone.clear()
+    assert m and not clone and not clone.inverse
+
+
+@pytest.mark.parametrize(
+    'duplicate', [copy.copy, copy.deepcopy, lambda m: pickle.loads(pickle.dumps(m))]
+)
+def test_bidirectional_map_copies_are_independent(duplicate):
+    m = collections.BidirectionalMap(a='b', b='c')
+    clone = duplicate(m)
+    assert type(clone) is collections.BidirectionalMap and clone == m
+    clone['d'] = 'e'
+    del clone.inverse['c']
+    assert m == dict(a='b', b='c') and dict(m.inverse) == dict(b='a', c='b')
+    assert clone == dict(a='b', d='e') and dict(clone.inverse) == dict(b='a', e='d')
+
+
+def test_dense_enumeration_matches_enumeration():
+    rand = random.Random(0)
+    names = [f'n{number}' for number in range(50)]
+    codes = rand.sample(range(-10, 70), len(names))
+    reference = collections.Enumeration(names, codes)
+    e = collections.DenseEnumeration(names, codes)
+    assert e.names == tuple(names) and e.codes == tuple(codes)
+    for key in names + list(range(-15, 75)):
+        assert e.get(key) == reference.get(key)
+    assert e.n7 == reference.n7
+    assert e.decode_many(codes) == names and e.encode_many(names) == codes
+    with pytest.raises(KeyError):
+        e.decode_many(codes + [-11])
+    for positive in True, False:
+        shifted = [code + 10 for code in codes] if positive else codes
+        table = collections.DenseEnumeration(names, shifted)
+        present = rand.sample(shifted, 20)
+        assert table.decode_many(present) == [table[code] for code in present]
+        missing = present + [max(shifted) + 1]
+        with pytest.raises(KeyError):
+            table.decode_many(missing)
+    for clone in copy.copy(e), pickle.loads(pickle.dumps(e)):
+        assert clone == e and clone.codes == e.codes
+    assert dict(e) == dict(reference)
+    with pytest.raises(TypeError):
+        e.update(x=1)
+
+
+def test_dense_enumeration_sparse_codes():
+    sparse = collections.DenseEnumeration(['a', 'b'], [2**40, 7])
+    assert sparse._table is None
+    assert sparse[2**40] == 'a' and sparse.decode_many([7, 2**40]) == ['b', 'a']
+    shifted = collections.DenseEnumeration('a b c', range(1000, 1003))
+    assert len(shifted._table) == 3
+    assert shifted.decode_many([1002, 1000]) == ['c', 'a']
+
+
+def test_dense_enumeration_edges():
+    empty = collections.DenseEnumeration([])
+    assert empty.names == empty.codes == () and len(empty) == 0
+    assert empty.decode_many([]) == []
+    with pytest.raises(KeyError):
+        empty.decode_many([0])
+    with pytest.raises(ValueError):
+        collections.DenseEnumeration('a b a')
+    with pytest.raises(ValueError):
+        collections.DenseEnumeration('a b', (1, 1))
+    e = collections.DenseEnumeration('a b')
+    with pytest.raises(KeyError):
+        e.decode_many([0, 2])
+    with pytest.raises(KeyError):
+        e.decode_many(['a'])
+    with pytest.raises(AttributeError):
+        e.c  # noqa: B018
+    for clone in copy.copy(e), copy.deepcopy(e), pickle.loads(pickle.dumps(e)):
+        assert type(clone) is type(e) and clone == e and clone.names == e.names
+
+
+def test_frozen_dict_hash():
+    rand = random.Random(0)
+    items = [(rand.choice([None, 1, 'a', (2,)]), rand.random()) for _ in range(20)]
+    frozen = collections.FrozenDict(items)
+    shuffled = list(frozen.items())
+    rand.shuffle(shuffled)
+    other = collections.FrozenDict(shuffled)
+    assert hash(frozen) == hash(other) == hash(frozenset(frozen.items()))
+    assert frozen == other
+    changed = collections.FrozenDict(frozen, extra=1)
+    assert hash(changed) != hash(frozen) and changed != frozen
+    restored = pickle.loads(pickle.dumps(frozen))
+    assert restored == frozen and hash(restored) == hash(frozen)
+    assert copy.copy(frozen) == frozen
+
+
+def test_frozen_dict_change_edges():
+    empty = collections.FrozenDict()
+    with pytest.raises(KeyError):
+        empty.delete('a')
+    single = empty.set('a', [])
+    assert empty == {} and single == {'a': []}
+    assert single.delete('a') == empty and hash(single.delete('a')) == hash(empty)
+    assert single.update() == single and single.set('a', []) == single
+    clone = copy.deepcopy(single)
+    clone['a'].append(1)
+    assert single == {'a': []}
+    assert pickle.loads(pickle.dumps(single.set('b', 2))) == {'a': [], 'b': 2}
+
+
+class Collider(int):
+    """
+    An int whose hash is shared by its neighbours.
+    """
+
+    def __hash__(self):
+        return int(self) // 3
+
+
+def test_frozen_dict_persistent_changes():
+    rand = random.Random(0)
+    keys = [*range(-40, 40), *map(Collider, range(60)), *(n << 45 for n in range(20))]
+    expected = dict.fromkeys(rand.sample(keys, 30), 'initial')
+    versions = [(collections.FrozenDict(expected), dict(expected))]
+    for step in range(2000):
+        frozen, expected = rand.choice(versions)
+        expected = dict(expected)
+        key = rand.choice(keys)
+        if rand.random() < 0.4:
+            if key in expected:
+                del expected[key]
+                frozen = frozen.delete(key)
+            else:
+                with pytest.raises(KeyError):
+                    frozen.delete(key)
+        elif rand.random() < 0.1:
+            changes = {key: step for key in rand.sample(keys, 5)}
+            expected.update(changes)
+            frozen = frozen.update(changes)
+        else:
+            expected[key] = step
+            frozen = frozen.set(key, step)
+        versions.append((frozen, expected))
+    for frozen, expected in rand.sample(versions, 100):
+        assert len(frozen) == len(expected) and frozen == expected
+        assert dict(frozen.items()) == expected
+        assert all(frozen[key] == value for key, value in expected.items())
+        assert all((key in frozen) == (key in expected) for key in keys)
+        rebuilt = collections.FrozenDict(expected)
+        assert hash(frozen) == hash(rebuilt) and frozen == rebuilt
+        assert pickle.loads(pickle.dumps(frozen)) == expected
+
+
+range_map_params = [
+    {},
+    dict(key_match_comparator=operator.lt),
+    dict(sort_params=dict(reverse=True), key_match_comparator=operator.ge),
+    dict(sort_params=dict(reverse=True), key_match_comparator=operator.gt),
+    dict(sort_params=dict(key=abs)),
+]
+
+
+def _linear_lookup(range_map, item):
+    keys = sorted(range_map.keys(), **range_map.sort_params)
+    return dict.__getitem__(range_map, range_map._find_first_match_(keys, item))
+
+
+@pytest.mark.parametrize('params', range_map_params)
+def test_range_map_bisect_matches_scan(params):
+    """
+    Lookups through the sorted index agree with a linear scan.
+    """
+    rand = random.Random(0)
+    source = {rand.randrange(-500, 500): rand.randrange(10) for _ in range(200)}
+    range_map = collections.RangeMap(source, **params)
+    for item in range(-520, 520):
+        try:
+            expected = _linear_lookup(range_map, item)
+        except KeyError:
+            expected = KeyError
+        assert range_map.get(item, KeyError) == expected
+
+
+def test_range_map_index_invalidated():
+    """
+    Every kind of mutation is reflected in subsequent lookups.
+    """
+    range_map = collections.RangeMap({3: 'a', 6: 'b'})
+    assert range_map.bounds() == (3, 6)
+    range_map[9] = 'c'
+    assert range_map[8] == 'c'
+    range_map.update({12: 'd'})
+    assert range_map[10] == 'd'
+    range_map |= {15: 'e'}
+    assert range_map[13] == 'e'
+    range_map.setdefault(18, 'f')
+    assert range_map[collections.RangeMap.last_item] == 'f'
+    range_map.pop(18)
+    assert range_map.bounds() == (3, 15)
+    del range_map[15]
+    range_map.popitem()
+    assert range_map.bounds() == (3, 9)
+    range_map.clear()
+    range_map[1] = 'z'
+    assert range_map[0] == 'z'
+
+
+@pytest.mark.parametrize('params', range_map_params)
+def test_range_map_pickle_after_lookup(params):
+    range_map = collections.RangeMap({3: 'a', 6: 'b'}, **params)
+    range_map.get(4)
+    for clone in (
+        pickle.loads(pickle.dumps(range_map)),
+        copy.copy(range_map),
+        copy.deepcopy(range_map),
+    ):
+        assert vars(clone).get('_index') is None
+        assert dict(clone) == dict(range_map)
+        assert [clone.get(item) for item in range(8)] == [
+            range_map.get(item) for item in range(8)
+        ]
+
+
+@pytest.mark.parametrize('params', range_map_params)
+def test_range_map_get_many(params):
+    """
+    Batched lookups agree with individual lookups, in any order.
+    """
+    source = {key: key // 20 for key in range(-100, 100, 10)}
+    source[0] = collections.RangeMap.undefined_value
+    range_map = collections.RangeMap(source, **params)
+    items = [item / 2 for item in range(-240, 240)]
+    for batch in items, items[::-1], items[::7]:
+        expected = [range_map.get(item, 'missing') for item in batch]
+        assert range_map.get_many(batch, 'missing') == expected
+        assert range_map.get_many(iter(batch), 'missing') == expected
+
+
+@pytest.mark.parametrize('params', range_map_params)
+def test_range_map_get_many_array(params):
+    numpy = pytest.importorskip('numpy')
+    source = {key: key // 20 for key in range(-100, 100, 10)}
+    source[0] = collections.RangeMap.undefined_value
+    range_map = collections.RangeMap(source, **params)
+    items = numpy.arange(-120, 120, 0.5)
+    result = range_map.get_many(items, 'missing')
+    assert isinstance(result, numpy.ndarray)
+    assert result.tolist() == [range_map.get(item, 'missing') for item in items]
+
+
+def test_range_map_get_many_edges():
+    empty = collections.RangeMap({})
+    assert empty.get_many([]) == []
+    assert empty.get_many([1, 2], 'missing') == ['missing', 'missing']
+    gapped = collections.RangeMap({0: collections.RangeMap.undefined_value, 3: 'a'})
+    assert gapped.get_many([], 'missing') == []
+    assert gapped.get_many([0, 3, 4, -1], 'missing') == [
+        'missing',
+        'a',
+        'missing',
+        'missing',
+    ]
+    assert gapped.get_many(item for item in [3, 0]) == ['a', None]
+
+
+def test_range_map_get_many_empty_array():
+    numpy = pytest.importorskip('numpy')
+    empty = collections.RangeMap({})
+    assert empty.get_many(numpy.array([], dtype=int)).tolist() == []
+    assert empty.get_many(numpy.array([1, 2]), 'missing').tolist() == ['missing'] * 2
+
+
+@pytest.mark.parametrize(
+    'duplicate', [copy.copy, copy.deepcopy, lambda m: pickle.loads(pickle.dumps(m))]
+)
+def test_range_map_mutate_after_copy(duplicate):
+    original = collections.RangeMap({1: 'a', 5: 'b'})
+    assert original[2] == 'b'
+    clone = duplicate(original)
+    clone[3] = 'c'
+    original[9] = 'd'
+    assert [original.get(item) for item in range(11)] == [*'aabbbbdddd', None]
+    assert [clone.get(item) for item in range(7)] == [*'aaccbb', None]
+
+
+def test_interval_map_queries():
+    """
+    Stabbing and overlap queries agree with a scan, across
+    assignments, replacements and deletions.
+    """
+    rand = random.Random(0)
+    reference = {}
+    interval_map = collections.IntervalMap()
+    for _ in range(300):
+        lo = rand.randrange(100)
+        hi = lo + rand.randrange(1, 20)
+        if (lo, hi) in reference and rand.random() < 0.5:
+            del reference[lo, hi]
+            del interval_map[lo:hi]
+            continue
+        reference[lo, hi] = interval_map[lo:hi] = rand.random()
+    assert len(interval_map) == len(reference)
+    assert list(interval_map.items()) == sorted(reference.items())
+    for point in range(-5, 125):
+        assert list(interval_map.stab(point)) == [
+            (lo, hi, value)
+            for (lo, hi), value in sorted(reference.items())
+            if lo <= point < hi
+        ]
+    for lo in range(-5, 125, 7):
+        hi = lo + 5
+        assert list(interval_map.overlap(lo, hi)) == [
+            (start, end, value)
+            for (start, end), value in sorted(reference.items())
+            if start < hi and lo < end
+        ]
+    for index in range(-len(reference), len(reference)):
+        expected = sorted(reference.items())[index][1]
+        assert interval_map[collections.IntervalMap.Item(index)] == expected
+
+
+def test_interval_map_missing():
+    interval_map = collections.IntervalMap()
+    with pytest.raises(IndexError):
+        interval_map.bounds()
+    with pytest.raises(KeyError):
+        del interval_map[1:2]
+    with pytest.raises(ValueError):
+        interval_map[1:5:2] = 'x'
+    with pytest.raises(ValueError):
+        interval_map[3:3] = 'x'
+    assert len(interval_map) == 0 and interval_map.get(1) is None
+    assert list(interval_map.stab(1)) == list(interval_map.overlap(0, 9)) == []
+    with pytest.raises(KeyError):
+        interval_map[1]
+
+
+def test_interval_map_mutate_after_copy():
+    original = collections.IntervalMap({(1, 3): 'a'})
+    for clone in copy.copy(original), pickle.loads(pickle.dumps(original)):
+        clone[2:4] = 'b'
+        del clone[1:3]
+        assert list(clone.items()) == [((2, 4), 'b')]
+    assert list(original.items()) == [((1, 3), 'a')]
+
+
+def test_frozen_range_map_empty():
+    empty = collections.FrozenRangeMap({})
+    assert len(empty) == 0 and list(empty) == [] and empty.get(1) is None
+    assert empty == collections.FrozenRangeMap({})
+    with pytest.raises(KeyError):
+        empty[1]
+    with pytest.raises(IndexError):
+        empty.bounds()
+
+
+@pytest.mark.parametrize('params', range_map_params)
+def test_frozen_range_map(params):
+    """
+    A FrozenRangeMap resolves every item as the RangeMap it's built from.
+    """
+    source = {key: str(key // 20) for key in range(-100, 100, 10)}
+    source[0] = collections.RangeMap.undefined_value
+    range_map = collections.RangeMap(source, **params)
+    frozen = collections.FrozenRangeMap.from_range_map(range_map)
+    for item in range(-120, 120):
+        assert frozen.get(item, KeyError) == range_map.get(item, KeyError)
+    assert frozen.bounds() == range_map.bounds()
+    assert len(frozen._values) == 11
+    for clone in (
+        pickle.loads(pickle.dumps(frozen)),
+        copy.copy(frozen),
+        copy.deepcopy(frozen),
+    ):
+        assert clone == frozen and hash(clone) == hash(frozen)
+        assert clone.get(5, KeyError) == frozen.get(5, KeyError)
+
+
+def test_weighted_lookup_sample_proportions():
+    """
+    Alias sampling selects values in proportion to their weights
+    and tracks modification.
+    """
+    lookup = collections.WeightedLookup(a=1, b=2, d=7)
+    sampled = lookup.sample(100_000, random.Random(0))
+    for value, weight in dict(a=1, b=2, d=7).items():
+        assert abs(sampled.count(value) / len(sampled) - weight / 10) < 0.01
+    lookup[20] = 'e'
+    sampled = lookup.sample(10_000, random.Random(0))
+    assert abs(sampled.count('e') / len(sampled) - 0.5) < 0.02
+
+
+@pytest.mark.parametrize(
+    'duplicate', [copy.copy, copy.deepcopy, lambda m: pickle.loads(pickle.dumps(m))]
+)
+def test_weighted_lookup_copy_after_sampling(duplicate):
+    lookup = collections.WeightedLookup(a=1, b=3)
+    lookup.sample(10, random.Random(0))
+    clone = duplicate(lookup)
+    assert '_alias' not in vars(clone)
+    clone[8] = 'c'
+    assert set(clone.sample(200, random.Random(0))) == {'a', 'b', 'c'}
+    assert set(lookup.sample(200, random.Random(0))) == {'a', 'b'}
+    assert clone[7.5] == 'c' and lookup.get(7.5) is None
+
+
+def test_dynamic_weighted_lookup():
+    """
+    Through additions, changes and removals, DynamicWeightedLookup
+    resolves positions as a WeightedLookup built from scratch would.
+    """
+    rand = random.Random(0)
+    weights = {key: rand.randrange(1, 5) for key in range(20)}
+    lookup = collections.DynamicWeightedLookup(weights)
+    for _ in range(200):
+        key = rand.randrange(30)
+        if key in weights and rand.random() < 0.3:
+            del weights[key]
+            lookup.remove(key)
+        else:
+            weights[key] = lookup_weight = rand.randrange(1, 5)
+            lookup.set_weight(key, lookup_weight)
+        expected = collections.WeightedLookup(
+            sorted(weights.items(), key=lambda item: lookup._slots[item[0]])
+        )
+        assert lookup.bounds()[1] == expected.bounds()[1]
+        for position in range(expected.bounds()[1]):
+            assert lookup[position] == expected[position]
+            assert lookup[position + 0.5] == expected[position + 0.5]
+    assert sorted(lookup) == sorted(weights)
+
+
+class _Uniform:
+    """
+    A stand-in for a Random, always drawing value.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+def test_dynamic_weighted_lookup_float_weights():
+    """
+    Rounding in sums of float weights neither selects a removed
+    key nor fails a draw, and copies resolve as the original.
+    """
+    rand = random.Random(0)
+    for _ in range(300):
+        lookup = collections.DynamicWeightedLookup(
+            (key, rand.random()) for key in range(10)
+        )
+        for key in rand.sample(range(10), 4):
+            lookup.set_weight(key, rand.random())
+        removed = rand.sample(range(10), 4)
+        for key in removed:
+            lookup.remove(key)
+        total = sum(map(lookup.weight, lookup))
+        for slot, key in enumerate(lookup._keys):
+            position = lookup._prefix(slot)
+            if position < total * (1 - 1e-9):
+                assert lookup[position] in lookup
+        assert lookup.random(_Uniform(1 - 2**-53)) in lookup
+        assert set(lookup.sample(50, rand)) <= set(lookup)
+    clone = pickle.loads(pickle.dumps(lookup))
+    assert clone.bounds() == pytest.approx(lookup.bounds())
+    assert copy.deepcopy(lookup).bounds() == pytest.approx(lookup.bounds())
+    assert sorted(clone) == sorted(lookup)
+    lookup = collections.DynamicWeightedLookup(a=2, b=2, c=1)
+    lookup.remove('a')
+    assert pickle.loads(pickle.dumps(lookup)).bounds() == (2, 3)
+
+
+def test_dynamic_weighted_lookup_empty():
+    emptied = collections.DynamicWeightedLookup(a=1)
+    emptied.remove('a')
+    for lookup in collections.DynamicWeightedLookup(), emptied:
+        with pytest.raises(IndexError):
+            lookup.bounds()
+        with pytest.raises(IndexError):
+            lookup.random()
+        assert lookup.get(0) is None and lookup.sample(0) == []
+
+
+def test_dynamic_weighted_lookup_negative_weight():
+    with pytest.raises(ValueError):
+        collections.DynamicWeightedLookup(a=1, b=-1)
+    lookup = collections.DynamicWeightedLookup(a=1)
+    with pytest.raises(ValueError):
+        lookup.set_weight('a', -0.5)
+    with pytest.raises(ValueError):
+        lookup.set_weight('b', -1)
+    assert dict(zip(lookup, map(lookup.weight, lookup))) == {'a': 1}
+    assert lookup.bounds() == (1, 1)
+
+
+def _contains(segment, point, closed_start):
+    start, end, _ = segment
+    after_start = start is None or (start <= point if closed_start else start < point)
+    before_end = end is None or (point < end if closed_start else point <= end)
+    return after_start and before_end
+
+
+@pytest.mark.parametrize('params', range_map_params[:4])
+def test_range_map_ranges(params):
+    """
+    Each point in a window falls in exactly one of the ranges
+    generated for that window, which supplies its value.
+    """
+    source = {key: key // 20 for key in range(-100, 100, 10)}
+    source[0] = collections.RangeMap.undefined_value
+    range_map = collections.RangeMap(source, **params)
+    closed_start = params.get('key_match_comparator') in (operator.lt, operator.ge)
+    for lo, hi in [(None, None), (-130, -50), (-7, 33), (15, 16), (40, 200)]:
+        segments = list(range_map.ranges(lo, hi))
+        start = -130 if lo is None else lo
+        stop = 130 if hi is None else hi
+        points = [value / 2 for value in range(start * 2, stop * 2)]
+        for segment in segments:
+            assert any(_contains(segment, point, closed_start) for point in points)
+        for point in points:
+            expected = range_map.get(point, KeyError)
+            found = [
+                segment[2]
+                for segment in segments
+                if _contains(segment, point, closed_start)
+            ]
+            assert found == ([] if expected is KeyError else [expected])
+
+
+@pytest.mark.parametrize(
+    'keys',
+    [
+        list(range(-100, 100, 10)),
+        [key / 4 for key in range(-100, 100, 10)],
+        [str(key).encode() for key in range(100, 300, 10)],
+    ],
+)
+@pytest.mark.parametrize('params', range_map_params[:4])
+def test_range_map_save_open(tmp_path, keys, params):
+    """
+    A saved map resolves every item as the original does.
+    """
+    source = dict(zip(keys, itertools.cycle('abc')))
+    source[keys[5]] = collections.RangeMap.undefined_value
+    range_map = collections.RangeMap(source, **params)
+    path = tmp_path / 'ranges.bin'
+    range_map.save(path)
+    saved = collections.RangeMap.open(path)
+    assert saved.bounds() == range_map.bounds()
+    assert saved == collections.FrozenRangeMap.from_range_map(range_map)
+    sorted_keys = sorted(keys)
+    if isinstance(keys[0], bytes):
+        items = [*sorted_keys, b'', b'1', b'15', b'9']
+    else:
+        items = [*sorted_keys, *(key + 1 for key in sorted_keys), sorted_keys[0] - 1]
+    for item in items:
+        assert saved.get(item, KeyError) == range_map.get(item, KeyError)
+    saved.close()
+    with pytest.raises(ValueError):
+        saved.bounds()
+    saved.close()
+    with collections.RangeMap.open(path) as reopened:
+        assert reopened.bounds() == range_map.bounds()
+    path.unlink()
+
+
+def test_range_map_save_unsupported(tmp_path):
+    path = tmp_path / 'ranges.bin'
+    with pytest.raises(TypeError):
+        collections.RangeMap({2**70: 'a'}).save(path)
+    with pytest.raises(ValueError):
+        collections.RangeMap({1: 'a'}, sort_params=dict(key=abs)).save(path)
+    path.write_bytes(bytes(64))
+    with pytest.raises(ValueError):
+        collections.RangeMap.open(path)
+
+
+def test_range_map_open_bad_header(tmp_path, monkeypatch):
+    """
+    A file that isn't a saved map of a supported version is
+    unmapped before the error is raised.
+    """
+    path = tmp_path / 'ranges.bin'
+    collections.RangeMap({1: 'a'}).save(path)
+    saved = path.read_bytes()
+    opened = []
+
+    def mapping(*args, original=mmap.mmap, **kwargs):
+        opened.append(original(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(mmap, 'mmap', mapping)
+    for content in b'XXXX' + saved[4:], saved[:4] + b'\xff' + saved[5:], saved[:10]:
+        path.write_bytes(content)
+        with pytest.raises((ValueError, struct.error)):
+            collections.RangeMap.open(path)
+        assert opened[-1].closed
+    assert len(opened) == 3
+
+
+@pytest.mark.parametrize('params', range_map_params[:4])
+def test_range_map_coalesce_merge(params):
+    """
+    Coalesced and merged maps resolve every item as expected,
+    and coalescing leaves no redundant keys.
+    """
+    rand = random.Random(0)
+    undefined = collections.RangeMap.undefined_value
+    choices = ['a', 'b', undefined]
+
+    def random_map():
+        source = {key: rand.choice(choices) for key in rand.sample(range(-50, 50), 30)}
+        return collections.RangeMap(source, **params)
+
+    mine, theirs = random_map(), random_map()
+    coalesced = mine.coalesce()
+    merged = mine.merge(theirs)
+    assert len(coalesced) < len(mine)
+    assert coalesced.coalesce() == coalesced
+    assert merged.coalesce() == merged
+    for item in (value / 2 for value in range(-120, 120)):
+        assert coalesced.get(item, KeyError) == mine.get(item, KeyError)
+        expected = theirs.get(item, KeyError)
+        if expected is KeyError:
+            expected = mine.get(item, KeyError)
+        assert merged.get(item, KeyError) == expected